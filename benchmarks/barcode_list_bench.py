@@ -0,0 +1,149 @@
+"""
+Проверка barcode-list на сохранённых страницах (benchmarks/fixtures): прежний путь
+(целиком скачать, построить дерево BeautifulSoup, найти ячейку) против потокового
+BarcodeTableExtractor, который останавливается на первой строке таблицы.
+
+CPU — время разбора одной страницы. Задержка — модель сети: страница приходит
+кусками по --chunk-size с паузой --chunk-ms после --rtt-ms; прежний путь ходит
+на два сайта по очереди, новый — одновременно и обрывает чтение.
+
+    pip install -r benchmarks/requirements.txt  # BeautifulSoup нужен только для сравнения
+    python -m benchmarks.barcode_list_bench --iterations 200
+"""
+import os
+import time
+import asyncio
+import argparse
+import timeit
+from typing import Callable, List, Optional
+from services.barcode_list import BarcodeTableExtractor
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def soup_path(html: str) -> bool:
+    # Прежняя реализация Parser.product_exists_in_barcode_lists
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table", class_="randomBarcodes")
+    if not table:
+        table = soup.find("table")
+    if table:
+        rows = table.find_all("tr")
+        if len(rows) > 1:
+            tds = rows[1].find_all("td")
+            if len(tds) >= 3 and tds[2].get_text(strip=True):
+                return True
+    return False
+
+
+def chunks(html: str, size: int) -> List[str]:
+    return [html[i:i + size] for i in range(0, len(html), size)]
+
+
+def stream_path(parts: List[str]) -> tuple[bool, int]:
+    extractor = BarcodeTableExtractor()
+    consumed = 0
+    for part in parts:
+        extractor.feed(part)
+        consumed += len(part)
+        if extractor.done:
+            break
+    extractor.close()
+    return extractor.found, consumed
+
+
+def cpu_us(fn: Callable[[], object], iterations: int) -> float:
+    fn()
+    return min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations * 1e6
+
+
+async def fetch_full(html: str, args) -> bool:
+    await asyncio.sleep(args.rtt_ms / 1000)
+    for _ in chunks(html, args.chunk_size):
+        await asyncio.sleep(args.chunk_ms / 1000)
+    return soup_path(html)
+
+
+async def fetch_stream(html: str, args) -> Optional[bool]:
+    await asyncio.sleep(args.rtt_ms / 1000)
+    extractor = BarcodeTableExtractor()
+    for part in chunks(html, args.chunk_size):
+        await asyncio.sleep(args.chunk_ms / 1000)
+        extractor.feed(part)
+        if extractor.done:
+            break
+    extractor.close()
+    return extractor.found
+
+
+async def old_lookup(pages: List[str], args) -> bool:
+    for html in pages:
+        if await fetch_full(html, args):
+            return True
+    return False
+
+
+async def new_lookup(pages: List[str], args) -> bool:
+    tasks = [asyncio.create_task(fetch_stream(html, args)) for html in pages]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            if await next_done:
+                return True
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def latency_ms(lookup, pages: List[str], args) -> float:
+    started = time.perf_counter()
+    await lookup(pages, args)
+    return (time.perf_counter() - started) * 1000
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--iterations", type=int, default=200)
+    arg_parser.add_argument("--chunk-size", type=int, default=16 * 1024)
+    arg_parser.add_argument("--chunk-ms", type=float, default=15)
+    arg_parser.add_argument("--rtt-ms", type=float, default=80)
+    args = arg_parser.parse_args()
+
+    try:
+        import bs4  # noqa: F401
+        have_soup = True
+    except ImportError:
+        have_soup = False
+        print("bs4 не установлен — прежний путь пропущен")
+
+    pages = {}
+    for name in ("found", "missing"):
+        with open(os.path.join(FIXTURES, f"barcode_list_{name}.html"), encoding="utf-8") as f:
+            pages[name] = f.read()
+
+    print("CPU на страницу:")
+    for name, html in pages.items():
+        parts = chunks(html, args.chunk_size)
+        found, consumed = stream_path(parts)
+        new = cpu_us(lambda: stream_path(parts), args.iterations)
+        line = f"  {name:>7}: поток {new:8.1f} мкс, прочитано {consumed / len(html):.0%} страницы, ответ {found}"
+        if have_soup:
+            assert soup_path(html) == found, "ответы прежнего и нового пути расходятся"
+            old = cpu_us(lambda: soup_path(html), args.iterations)
+            line += f"; BeautifulSoup {old:8.1f} мкс ({old / new:.1f}x)"
+        print(line)
+
+    print("Задержка проверки по двум сайтам (модель сети):")
+    for name, html in pages.items():
+        both = [html, html]
+        new = asyncio.run(latency_ms(new_lookup, both, args))
+        line = f"  {name:>7}: одновременно с обрывом {new:7.1f} мс"
+        if have_soup:
+            old = asyncio.run(latency_ms(old_lookup, both, args))
+            line += f", по очереди целиком {old:7.1f} мс"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
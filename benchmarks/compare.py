@@ -0,0 +1,42 @@
+"""
+Сравнение двух прогонов нагрузочного теста (JSON из benchmarks/results).
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import sys
+import json
+
+FIELDS = ("rps", "p50_ms", "p95_ms", "p99_ms", "errors")
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def delta(before: float, after: float) -> str:
+    if not before:
+        return f"{after}"
+    return f"{after} ({(after - before) / before * 100:+.1f}%)"
+
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        raise SystemExit("Использование: python -m benchmarks.compare <до.json> <после.json>")
+    before, after = load(sys.argv[1]), load(sys.argv[2])
+    print(f"до: {before.get('git_revision')}  после: {after.get('git_revision')}")
+    rows = [("всего", before["total"], after["total"])]
+    rows += [
+        (name, before["scenarios"][name], stats)
+        for name, stats in after["scenarios"].items() if name in before["scenarios"]
+    ]
+    for name, old, new in rows:
+        print(f"{name}:")
+        for field in FIELDS:
+            print(f"  {field:>7}: {old[field]} -> {delta(old[field], new[field])}")
+    for field in ("rss_peak_mb", "rss_end_mb"):
+        print(f"{field}: {before['memory'][field]} -> {delta(before['memory'][field], after['memory'][field])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Локальные заглушки внешних сервисов для нагрузочных тестов: rskrf.ru, OpenFoodFacts,
+barcode-list и OpenAI (Responses и Chat Completions API, а также Files и Batch API
+для пакетного анализа импортов). Каждый сервис слушает свой порт, чтобы ограничения
+«на хост» в приложении работали как в проде.
+
+Ответ детерминирован штрихкодом: доля найденных задаётся --hit-rate, задержка —
+--latency-ms ± --jitter-ms, доля ответов 503 — --error-rate.
+
+    python -m benchmarks.fakes --port 9100 --latency-ms 80 --error-rate 0.01
+"""
+import io
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import argparse
+from dataclasses import dataclass
+from typing import Dict, Set
+import uvicorn
+from fastapi import FastAPI, File, Form, Request, Response, UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse
+
+# Порядок задаёт смещение порта относительно --port
+SERVICES = ("roskachestvo", "openfoodfacts", "barcode_list_ru", "barcode_list_com", "openai")
+
+ANALYSIS = {
+    "product_name": "Тестовый продукт",
+    "manufacturer": "ООО «Бенчмарк»",
+    "ingredients": "вода, сахар, E330",
+    "allergens": "нет",
+    "overall_score": 64,
+    "explanation_score": "Умеренное содержание сахара, есть регулятор кислотности.",
+    "nutrition": {"proteins": 1.0, "fats": 0.5, "carbohydrates": 12.0, "calories": 230, "kcal": 55},
+    "harmful_components": [],
+    "recommendedfor": "взрослым",
+    "frequency": "несколько раз в неделю",
+    "alternatives": "вода",
+    "tags": ["продукты питания", "напитки"],
+}
+
+
+@dataclass
+class Profile:
+    latency_ms: float = 50.0
+    jitter_ms: float = 20.0
+    error_rate: float = 0.0
+    hit_rate: float = 0.7
+    llm_latency_ms: float = 800.0
+
+    async def delay(self, base_ms: float) -> None:
+        await asyncio.sleep(max(0.0, base_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+    def fail(self) -> bool:
+        return random.random() < self.error_rate
+
+    def found(self, barcode: str, salt: str) -> bool:
+        # Одинаковый ответ на один и тот же штрихкод, но разный у разных источников
+        digest = hashlib.sha256(f"{salt}:{barcode}".encode()).digest()
+        return int.from_bytes(digest[:4], "big") / 2 ** 32 < self.hit_rate
+
+
+def sample_jpeg(size: int = 320) -> bytes:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size), (200, 120, 40)).save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def roskachestvo_app(profile: Profile) -> FastAPI:
+    app = FastAPI()
+    image = sample_jpeg()
+
+    @app.get("/rest/1/search/barcode")
+    async def search(barcode: str, request: Request):
+        await profile.delay(profile.latency_ms)
+        if profile.fail():
+            return Response(status_code=503)
+        if not profile.found(barcode, "roskachestvo"):
+            return JSONResponse({"response": {}}, status_code=404)
+        base = str(request.base_url).rstrip("/")
+        return {
+            "response": {
+                "title": f"Товар {barcode}",
+                "total_rating": 4.2,
+                "description": "Исследован Роскачеством",
+                "category_name": "Напитки",
+                "manufacturer": "ООО «Бенчмарк»",
+                "thumbnail": f"{base}/images/{barcode}.jpg",
+                "research": {"image": f"{base}/images/{barcode}.jpg"},
+            }
+        }
+
+    @app.get("/images/{name}")
+    async def thumbnail(name: str):
+        await profile.delay(profile.latency_ms)
+        return Response(image, media_type="image/jpeg", headers={"ETag": '"bench"'})
+
+    return app
+
+
+def openfoodfacts_app(profile: Profile) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/api/v2/product/{name}")
+    async def product(name: str):
+        await profile.delay(profile.latency_ms)
+        if profile.fail():
+            return Response(status_code=503)
+        barcode = name.removesuffix(".json")
+        if not profile.found(barcode, "openfoodfacts"):
+            return JSONResponse({"status": 0, "status_verbose": "product not found"}, status_code=404)
+        return {
+            "status": 1,
+            "product": {
+                "product_name": f"Product {barcode}",
+                "ingredients_text": "water, sugar, citric acid",
+                "allergens": "",
+                "brands": "Bench",
+                "nutriments": {"energy-kcal_100g": 40, "sugars_100g": 9.5},
+                "nutriscore_grade": "c",
+                "categories": "Beverages",
+                "quantity": "500 ml",
+            },
+        }
+
+    return app
+
+
+def barcode_list_app(profile: Profile, salt: str) -> FastAPI:
+    app = FastAPI()
+
+    async def page(barcode: str) -> Response:
+        await profile.delay(profile.latency_ms)
+        if profile.fail():
+            return Response(status_code=503)
+        rows = ""
+        if profile.found(barcode, salt):
+            rows = f"<tr><td>1</td><td>{barcode}</td><td>Товар {barcode}</td><td>шт</td></tr>"
+        # Реальная страница большая: меню, реклама, скрипты — имитируем вес разметки
+        filler = "<div class='menu'><a href='#'>пункт</a></div>" * 400
+        return HTMLResponse(
+            f"<html><body>{filler}<table class='randomBarcodes'>"
+            f"<tr><th>№</th><th>Штрихкод</th><th>Наименование</th><th>Ед.</th></tr>{rows}"
+            f"</table>{filler}</body></html>"
+        )
+
+    @app.get("/barcode/RU/{name}")
+    async def search_ru(name: str, barcode: str = ""):
+        return await page(barcode)
+
+    @app.get("/barcode/EN/barcode-{barcode}/Search.htm")
+    async def search_com(barcode: str):
+        return await page(barcode)
+
+    return app
+
+
+def response_body(body: dict) -> dict:
+    text = json.dumps(ANALYSIS, ensure_ascii=False)
+    input_tokens = len(json.dumps(body, ensure_ascii=False)) // 4
+    output_tokens = len(text) // 4
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": body.get("model", "gpt-4.1-nano"),
+        "output": [{
+            "type": "message",
+            "id": f"msg_{uuid.uuid4().hex}",
+            "status": "completed",
+            "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+def openai_app(profile: Profile) -> FastAPI:
+    app = FastAPI()
+    files: Dict[str, bytes] = {}
+    batches: Dict[str, dict] = {}
+    running: Set[asyncio.Task] = set()
+
+    @app.post("/v1/responses")
+    async def responses(request: Request):
+        body = await request.json()
+        await profile.delay(profile.llm_latency_ms)
+        if profile.fail():
+            return JSONResponse({"error": {"message": "overloaded", "type": "server_error"}}, status_code=503)
+        return response_body(body)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        # Анализ фотографий при загрузке (/update) идёт через Chat Completions
+        body = await request.json()
+        await profile.delay(profile.llm_latency_ms)
+        if profile.fail():
+            return JSONResponse({"error": {"message": "overloaded", "type": "server_error"}}, status_code=503)
+        text = json.dumps(ANALYSIS, ensure_ascii=False)
+        prompt_tokens = len(json.dumps(body, ensure_ascii=False)) // 4
+        completion_tokens = len(text) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4.1"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def store_file(content: bytes, filename: str, purpose: str) -> dict:
+        file_id = f"file-{uuid.uuid4().hex}"
+        files[file_id] = content
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+
+    @app.post("/v1/files")
+    async def upload(file: UploadFile = File(...), purpose: str = Form(...)):
+        return store_file(await file.read(), file.filename or "upload.jsonl", purpose)
+
+    @app.get("/v1/files/{file_id}/content")
+    async def file_content(file_id: str):
+        if file_id not in files:
+            return JSONResponse({"error": {"message": "No such file", "type": "invalid_request_error"}}, status_code=404)
+        return Response(files[file_id], media_type="application/octet-stream")
+
+    async def process(batch: dict) -> None:
+        # Весь пакет «обрабатывается» за одну задержку LLM; доля строк с ошибкой — --error-rate
+        await profile.delay(profile.llm_latency_ms)
+        output, errors = [], []
+        for line in files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            record = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"]}
+            if profile.fail():
+                errors.append({**record, "response": {"status_code": 500, "request_id": uuid.uuid4().hex, "body": {
+                    "error": {"message": "overloaded", "type": "server_error"},
+                }}, "error": None})
+            else:
+                output.append({**record, "response": {
+                    "status_code": 200, "request_id": uuid.uuid4().hex, "body": response_body(request["body"]),
+                }, "error": None})
+        batch["request_counts"] = {
+            "total": len(output) + len(errors), "completed": len(output), "failed": len(errors),
+        }
+        if output:
+            dump = "\n".join(json.dumps(item, ensure_ascii=False) for item in output).encode("utf-8")
+            batch["output_file_id"] = store_file(dump, "output.jsonl", "batch_output")["id"]
+        if errors:
+            dump = "\n".join(json.dumps(item, ensure_ascii=False) for item in errors).encode("utf-8")
+            batch["error_file_id"] = store_file(dump, "errors.jsonl", "batch_output")["id"]
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    @app.post("/v1/batches")
+    async def create_batch(request: Request):
+        body = await request.json()
+        if body.get("input_file_id") not in files:
+            return JSONResponse({"error": {"message": "No such file", "type": "invalid_request_error"}}, status_code=400)
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch = batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        task = asyncio.create_task(process(batch))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        return batch
+
+    @app.get("/v1/batches/{batch_id}")
+    async def retrieve_batch(batch_id: str):
+        if batch_id not in batches:
+            return JSONResponse({"error": {"message": "No such batch", "type": "invalid_request_error"}}, status_code=404)
+        return batches[batch_id]
+
+    return app
+
+
+def build_apps(profile: Profile) -> Dict[str, FastAPI]:
+    return {
+        "roskachestvo": roskachestvo_app(profile),
+        "openfoodfacts": openfoodfacts_app(profile),
+        "barcode_list_ru": barcode_list_app(profile, "barcode_list_ru"),
+        "barcode_list_com": barcode_list_app(profile, "barcode_list_com"),
+        "openai": openai_app(profile),
+    }
+
+
+def upstream_env(host: str, port: int) -> Dict[str, str]:
+    """
+    Переменные окружения, направляющие приложение на заглушки, запущенные с --port port.
+    """
+    urls = {name: f"http://{host}:{port + i}" for i, name in enumerate(SERVICES)}
+    return {
+        "ROSKACHESTVO_BASE_URL": urls["roskachestvo"],
+        "OPENFOODFACTS_BASE_URL": urls["openfoodfacts"],
+        "BARCODE_LIST_RU_BASE_URL": urls["barcode_list_ru"],
+        "BARCODE_LIST_COM_BASE_URL": urls["barcode_list_com"],
+        # base_url клиента OpenAI SDK берёт из OPENAI_BASE_URL
+        "OPENAI_BASE_URL": f"{urls['openai']}/v1",
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-bench"),
+    }
+
+
+async def serve(profile: Profile, host: str, port: int) -> None:
+    servers = [
+        uvicorn.Server(uvicorn.Config(app, host=host, port=port + i, log_level="warning", access_log=False))
+        for i, app in enumerate(build_apps(profile).values())
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=9100)
+    arg_parser.add_argument("--latency-ms", type=float, default=50.0)
+    arg_parser.add_argument("--jitter-ms", type=float, default=20.0)
+    arg_parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    arg_parser.add_argument("--error-rate", type=float, default=0.0)
+    arg_parser.add_argument("--hit-rate", type=float, default=0.7)
+    args = arg_parser.parse_args()
+    profile = Profile(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        hit_rate=args.hit_rate,
+        llm_latency_ms=args.llm_latency_ms,
+    )
+    for name, value in upstream_env(args.host, args.port).items():
+        print(f"{name}={value}")
+    asyncio.run(serve(profile, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
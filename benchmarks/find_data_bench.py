@@ -0,0 +1,65 @@
+"""
+Микро-бенчмарк CPU на один запрос /find: старый путь (ORM-объект -> model_validate ->
+повторная валидация и сериализация через response_model) против лёгкого
+(строка -> model_construct -> model_dump_json). БД не нужна.
+
+    python -m benchmarks.find_data_bench --iterations 20000
+"""
+import argparse
+import json
+import timeit
+from pydantic import TypeAdapter
+from models import Product, ProductDB, ProductStatus
+
+ROW = {
+    "barcode": "4601234567890",
+    "product_name": "Молоко пастеризованное 3,2%",
+    "manufacturer": "ООО «Молочный завод»",
+    "score": 78.0,
+    "nutrition": {"proteins": 3.0, "fats": 3.2, "carbohydrates": 4.7, "calories": 250, "kcal": 60},
+    "allergens": "лактоза",
+    "extra": {
+        "ingredients": "молоко нормализованное",
+        "explanation_score": "Натуральный состав, без добавок.",
+        "harmful_components": [],
+        "recommendedfor": "всем, кроме людей с непереносимостью лактозы",
+        "frequency": "ежедневно",
+        "alternatives": "кефир, ряженка",
+    },
+    "image_front": "https://iscan.store/static/images/4601234567890_roskachestvo.jpg",
+    "image_ingredients": None,
+    "tags": ["продукты питания", "молочные продукты", "без добавок"],
+    "status": ProductStatus.verified,
+}
+
+adapter = TypeAdapter(Product)
+
+
+def orm_path() -> bytes:
+    instance = ProductDB(**ROW)
+    product = Product.model_validate(instance)
+    # Так FastAPI обрабатывает возвращённую модель при заданном response_model
+    validated = adapter.validate_python(product.model_dump(by_alias=True))
+    return json.dumps(adapter.dump_python(validated, mode="json"), ensure_ascii=False).encode("utf-8")
+
+
+def lean_path() -> bytes:
+    return Product.model_construct(**ROW).model_dump_json().encode("utf-8")
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--iterations", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    results = {}
+    for name, fn in (("orm", orm_path), ("lean", lean_path)):
+        fn()
+        seconds = min(timeit.repeat(fn, number=args.iterations, repeat=3))
+        results[name] = seconds / args.iterations * 1e6
+        print(f"{name:>5}: {results[name]:.1f} мкс/запрос")
+    print(f"экономия: {results['orm'] - results['lean']:.1f} мкс/запрос ({results['orm'] / results['lean']:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,112 +1,587 @@
 import os
+import time
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select
-from typing import Optional, List
-from models import Product, ProductDB, ProductStatus
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import exc
+from sqlalchemy import select, func, text, or_, and_, case, bindparam, union
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, AsyncIterator, Sequence, Tuple
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import Product, ProductDB, ProductStatus, ImportJobDB, SEARCH_VECTOR_SQL
+from services.cache import product_cache, EncodedProduct
+from services.metrics import timed
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL не задан в переменных окружения.")
+APP_ENV = os.getenv("APP_ENV", "development").lower()
+IS_PRODUCTION = APP_ENV == "production"
 
-# Важно: используем драйвер asyncpg и отключаем кэширование подготовленных запросов
-engine = create_async_engine(
-    DATABASE_URL, 
-    echo=True, 
-    connect_args={"statement_cache_size": 0}
+def env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def record(self, waited: float) -> None:
+        self.checkouts += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+pool_stats = PoolStats()
+
+class MeasuredQueuePool(AsyncAdaptedQueuePool):
+    # Замеряем ожидание свободного соединения, чтобы видеть голодание пула
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.record(time.perf_counter() - started)
+
+# Соединения делятся между воркерами: DB_CONNECTION_BUDGET — общий лимит на все процессы
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "40"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(max(2, DB_CONNECTION_BUDGET // WEB_CONCURRENCY // 2))))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(max(0, DB_CONNECTION_BUDGET // WEB_CONCURRENCY - DB_POOL_SIZE))))
+# Кэш подготовленных запросов asyncpg выключен, как и раньше: за PgBouncer в режиме transaction
+# он даёт «prepared statement already exists». Включать только при прямом подключении к Postgres.
+DB_STATEMENT_CACHE = env_flag("DB_STATEMENT_CACHE", False)
+DB_STATEMENT_TIMEOUT_MS = os.getenv("DB_STATEMENT_TIMEOUT_MS")
+
+connect_args: dict = {}
+if not DB_STATEMENT_CACHE:
+    connect_args["statement_cache_size"] = 0
+if DB_STATEMENT_TIMEOUT_MS:
+    connect_args["server_settings"] = {"statement_timeout": DB_STATEMENT_TIMEOUT_MS}
+
+def build_engine() -> AsyncEngine:
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL не задан в переменных окружения.")
+    return create_async_engine(
+        database_url,
+        echo=env_flag("DB_ECHO", not IS_PRODUCTION),
+        poolclass=MeasuredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=env_flag("DB_POOL_PRE_PING", True),
+        connect_args=connect_args,
+    )
+
+def async_session() -> AsyncSession:
+    return db.session()
+
+# Поднимается при любом изменении схемы; init_db мигрирует, только если в БД версия другая
+SCHEMA_VERSION = 4
+
+UPSERT_CHUNK_SIZE = int(os.getenv("DB_UPSERT_CHUNK_SIZE", "500"))
+UPSERT_COLUMNS = (
+    "product_name", "manufacturer", "score", "nutrition", "allergens",
+    "extra", "image_front", "image_ingredients", "tags", "status",
+)
+
+def product_row(product: Product) -> dict:
+    row = {column: getattr(product, column) for column in UPSERT_COLUMNS}
+    row["barcode"] = product.barcode
+    row["status"] = product.status or ProductStatus.pending
+    return row
+
+PRODUCT_FIELDS = (
+    "id", "barcode", "product_name", "manufacturer", "score", "nutrition", "allergens",
+    "extra", "image_front", "image_ingredients", "tags", "status",
 )
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+def product_filters(
+    status: Optional[ProductStatus] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    tags: Optional[List[str]] = None,
+    name_prefix: Optional[str] = None,
+) -> list:
+    conditions = []
+    if status is not None:
+        conditions.append(ProductDB.status == status)
+    if min_score is not None:
+        conditions.append(ProductDB.score >= min_score)
+    if max_score is not None:
+        conditions.append(ProductDB.score <= max_score)
+    if tags:
+        # JSONB @> — использует idx_products_tags_gin
+        conditions.append(ProductDB.tags.contains(tags))
+    if name_prefix:
+        conditions.append(ProductDB.product_name.startswith(name_prefix, autoescape=True))
+    return conditions
+
+def product_columns(fields: Optional[Sequence[str]]) -> list:
+    fields = fields or PRODUCT_FIELDS
+    table = ProductDB.__table__
+    # id нужен всегда — это курсор пагинации
+    return [table.c.id] + [table.c[name] for name in fields if name != "id"]
+
+# Названия, с которыми товар сохранялся без данных (barcode-list или неудачный анализ)
+EMPTY_PRODUCT_NAMES = ("", "No Title", "No Product Name")
+
+def empty_name_condition():
+    table = ProductDB.__table__
+    return or_(table.c.product_name.is_(None), table.c.product_name.in_(EMPTY_PRODUCT_NAMES))
+
+# Колонки ответа /find — ровно поля модели Product
+LOOKUP_COLUMNS = [ProductDB.__table__.c[name] for name in PRODUCT_FIELDS if name != "id"]
 
 class Database:
     def __init__(self):
-        self.engine = engine
+        # Движок и пул создаются при первом обращении, а не при импорте модуля
+        self._engine: Optional[AsyncEngine] = None
+        self._sessionmaker: Optional[async_sessionmaker] = None
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            self._engine = build_engine()
+        return self._engine
+
+    def session(self) -> AsyncSession:
+        if self._sessionmaker is None:
+            self._sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        return self._sessionmaker()
+
+    async def shutdown(self) -> None:
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+            self._sessionmaker = None
+
+    def pool_status(self) -> dict:
+        if self._engine is None:
+            return {}
+        pool = self._engine.pool
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checked_in": pool.checkedin(),
+            "checkouts": pool_stats.checkouts,
+            "wait_avg_ms": round(pool_stats.wait_total / pool_stats.checkouts * 1000, 3) if pool_stats.checkouts else 0.0,
+            "wait_max_ms": round(pool_stats.wait_max * 1000, 3),
+            "timeouts": pool_stats.timeouts,
+        }
+
+    async def schema_version(self, conn) -> Optional[int]:
+        exists = await conn.scalar(text("SELECT to_regclass('schema_version') IS NOT NULL"))
+        if not exists:
+            return None
+        return await conn.scalar(text("SELECT max(version) FROM schema_version"))
 
     async def init_db(self) -> None:
-        if os.getenv("RESET_DB"):
-            async with engine.begin() as conn:
-                from models import Base
-                await conn.run_sync(Base.metadata.drop_all)
+        reset = bool(os.getenv("RESET_DB"))
+        if not reset:
+            # Обычный старт: один лёгкий запрос вместо create_all и проверки каждого индекса
+            async with self.engine.connect() as conn:
+                if await self.schema_version(conn) == SCHEMA_VERSION:
+                    return
         async with self.engine.begin() as conn:
             from models import Base
-            await conn.run_sync(Base.metadata.create_all)
+            # Несколько воркеров стартуют одновременно — DDL выполняем по очереди
+            await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('aiscan_init_db'))"))
+            if reset:
+                await conn.run_sync(Base.metadata.drop_all)
+                await conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+            elif await self.schema_version(conn) == SCHEMA_VERSION:
+                # Схему уже обновил воркер, который держал блокировку до нас
+                return
+            await self.migrate(conn)
+            await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version integer NOT NULL)"))
+            await conn.execute(text("DELETE FROM schema_version"))
+            await conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": SCHEMA_VERSION})
+
+    async def migrate(self, conn) -> None:
+        """
+        Приводит схему к текущей версии. Все шаги идемпотентны: выполняются
+        и на пустой базе, и поверх любой из прошлых версий.
+        """
+        from models import Base
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        await conn.run_sync(Base.metadata.create_all)
+        # Колонка поиска для таблиц, созданных до её появления
+        await conn.execute(text(
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED"
+        ))
+        # Версия 2: свежесть данных и популярность для фонового обновления
+        for ddl in (
+            "ADD COLUMN IF NOT EXISTS fetched_at timestamptz",
+            "ADD COLUMN IF NOT EXISTS analyzed_at timestamptz",
+            "ADD COLUMN IF NOT EXISTS scan_count integer NOT NULL DEFAULT 0",
+            "ADD COLUMN IF NOT EXISTS last_scanned_at timestamptz",
+            "ADD COLUMN IF NOT EXISTS refresh_attempted_at timestamptz",
+            # Версия 3: правки админа
+            "ADD COLUMN IF NOT EXISTS edited_at timestamptz",
+        ):
+            await conn.execute(text(f"ALTER TABLE products {ddl}"))
+        # Версия 4: состояние пакетного анализа импорта
+        await conn.execute(text("ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS analysis json"))
+        # Строкам, созданным до версии 2, нужна дата получения данных, иначе первый же проход
+        # обновления поставит в очередь весь каталог. Разносим её по окну устаревания:
+        # старые товары будут устаревать постепенно, а не все разом.
+        await conn.execute(
+            text(
+                "UPDATE products SET fetched_at = now() - random() * make_interval(days => :days) "
+                "WHERE fetched_at IS NULL AND status <> 'pending'"
+            ),
+            {"days": int(float(os.getenv("REFRESH_MAX_AGE_DAYS", "30")))},
+        )
+        # create_all не добавляет новые индексы к уже существующим таблицам
+        for index in ProductDB.__table__.indexes:
+            await conn.run_sync(index.create, checkfirst=True)
 
     async def find_data(self, barcode: str) -> Optional[Product]:
-        async with async_session() as session:
-            result = await session.execute(select(ProductDB).filter(ProductDB.barcode == barcode))
-            product_instance = result.scalars().first()
-            if product_instance:
-                return Product.model_validate(product_instance)
+        entry = await self.find_encoded(barcode)
+        return entry.product if entry is not None else None
+
+    async def find_encoded(self, barcode: str) -> Optional[EncodedProduct]:
+        entry = product_cache.get_entry(barcode) or await product_cache.get_shared(barcode)
+        if entry is not None:
+            return entry
+        token = await product_cache.fill_token()
+        product = await self._load_product(barcode)
+        if product is None:
             return None
+        return await product_cache.store(product, token)
 
-    async def save_data(self, product: Product) -> None:
-        async with async_session() as session:
-            db_product = ProductDB(
-                barcode=product.barcode,
-                product_name=product.product_name,
-                manufacturer=product.manufacturer,
-                score=product.score,
-                nutrition=product.nutrition,
-                allergens=product.allergens,
-                extra=product.extra,
-                image_front=product.image_front,
-                image_ingredients=product.image_ingredients,
-                tags=product.tags,
-                status=product.status or ProductStatus.pending,
+    @timed("db_find")
+    async def _load_product(self, barcode: str) -> Optional[Product]:
+        # Лёгкий путь чтения: только нужные колонки обычными строками, без ORM-сессии,
+        # identity map и повторной валидации — данные из своей же БД уже корректны
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                select(*LOOKUP_COLUMNS).where(ProductDB.__table__.c.barcode == barcode)
             )
-            session.add(db_product)
+            row = result.mappings().first()
+        if row is None:
+            return None
+        return Product.model_construct(**row)
+
+    @timed("db_save")
+    async def save_data(self, product: Product, analyzed: bool = True) -> Product:
+        """
+        Сохраняет найденный сканером товар, только если его ещё нет (ON CONFLICT DO NOTHING).
+        Пока шёл поиск, товар могли загрузить с фото или обновить в фоне — такую запись
+        не затираем и возвращаем её вместо найденной.
+        """
+        row = {**product_row(product), **self._stamps(fetched=True, analyzed=analyzed)}
+        async with self.session() as session:
+            result = await session.execute(
+                pg_insert(ProductDB.__table__).values(row)
+                .on_conflict_do_nothing(index_elements=[ProductDB.__table__.c.barcode])
+                .returning(ProductDB.__table__.c.id)
+            )
+            inserted = result.first() is not None
             await session.commit()
+        if inserted:
+            await product_cache.invalidate(product.barcode)
+            return product
+        return await self._load_product(product.barcode) or product
+
+    @timed("db_list")
+    async def list_products(
+        self,
+        after_id: Optional[int] = None,
+        limit: int = 100,
+        fields: Optional[Sequence[str]] = None,
+        **filters,
+    ) -> Tuple[List[dict], Optional[int]]:
+        """
+        Keyset-пагинация по id: возвращает страницу строк (только запрошенные поля)
+        и курсор следующей страницы либо None, если страница последняя.
+        """
+        stmt = select(*product_columns(fields)).where(*product_filters(**filters))
+        if after_id is not None:
+            stmt = stmt.where(ProductDB.id > after_id)
+        stmt = stmt.order_by(ProductDB.id).limit(limit + 1)
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            rows = [dict(row._mapping) for row in result]
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1]["id"]
+        return rows, None
 
-    async def get_all_data(self) -> List[Product]:
-        async with async_session() as session:
-            result = await session.execute(select(ProductDB))
-            products = result.scalars().all()
-            return [Product.model_validate(p) for p in products]
-        
+    async def stream_products(
+        self,
+        fields: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+        **filters,
+    ) -> AsyncIterator[dict]:
+        # Серверный курсор: в памяти одновременно не больше batch_size строк
+        stmt = (
+            select(*product_columns(fields))
+            .where(*product_filters(**filters))
+            .order_by(ProductDB.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async with self.session() as session:
+            result = await session.stream(stmt)
+            async for row in result:
+                yield dict(row._mapping)
+
+    @timed("db_search")
+    async def search_products(
+        self,
+        query: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Tuple[List[Product], Optional[int]]:
+        """
+        Поиск по названию, производителю и составу (tsvector + триграммы по названию)
+        и по тегам (JSONB @>). Результаты ранжируются по релевантности.
+        """
+        conditions = []
+        rank = None
+        if query:
+            tsquery = func.websearch_to_tsquery("russian", query)
+            similarity = func.similarity(ProductDB.product_name, query)
+            conditions.append(or_(
+                ProductDB.search_vector.bool_op("@@")(tsquery),
+                ProductDB.product_name.bool_op("%")(query),
+            ))
+            rank = func.ts_rank_cd(ProductDB.search_vector, tsquery) + similarity
+        if tags:
+            conditions.append(ProductDB.tags.contains(tags))
+        stmt = select(ProductDB).where(*conditions)
+        if rank is not None:
+            stmt = stmt.order_by(rank.desc(), ProductDB.id)
+        else:
+            stmt = stmt.order_by(ProductDB.id)
+        stmt = stmt.limit(limit + 1).offset(offset)
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            found = [Product.model_validate(p) for p in result.scalars().all()]
+        if len(found) > limit:
+            return found[:limit], offset + limit
+        return found, None
+
+    @timed("db_delete")
     async def delete_data(self, barcode: str) -> None:
-        async with async_session() as session:
+        async with self.session() as session:
             await session.execute(
                 ProductDB.__table__.delete().where(ProductDB.barcode == barcode)
             )
             await session.commit()
+        await product_cache.invalidate(barcode)
+
+    async def upsert_data(self, product: Product, fetched: bool = True, analyzed: bool = True) -> None:
+        await self.upsert_many([product], fetched=fetched, analyzed=analyzed)
+
+    def _stamps(self, fetched: bool, analyzed: bool) -> Dict[str, datetime]:
+        now = datetime.now(timezone.utc)
+        stamps = {}
+        if fetched:
+            stamps["fetched_at"] = now
+        if analyzed:
+            stamps["analyzed_at"] = now
+        return stamps
+
+    @timed("db_upsert")
+    async def upsert_many(
+        self, products: List[Product], fetched: bool = True, analyzed: bool = True, keep_edited: bool = False
+    ) -> Dict[str, int]:
+        """
+        Пакетный upsert по barcode: INSERT ... ON CONFLICT (barcode) DO UPDATE ... RETURNING,
+        по одному запросу на пачку из UPSERT_CHUNK_SIZE строк, всё в одной транзакции.
+        fetched/analyzed отмечают, что данные источника / анализ получены только что.
+        keep_edited — не перезаписывать товары, исправленные в панели.
+        Возвращает {barcode: id}.
+        """
+        stamps = self._stamps(fetched, analyzed)
+        # В одном INSERT ... ON CONFLICT строка не может обновиться дважды — оставляем последнюю версию
+        rows = list({product.barcode: {**product_row(product), **stamps} for product in products}.values())
+        ids: Dict[str, int] = {}
+        if not rows:
+            return ids
+        async with self.session() as session:
+            for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                stmt = pg_insert(ProductDB.__table__).values(rows[start:start + UPSERT_CHUNK_SIZE])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[ProductDB.__table__.c.barcode],
+                    set_={column: stmt.excluded[column] for column in (*UPSERT_COLUMNS, *stamps)},
+                    where=ProductDB.__table__.c.edited_at.is_(None) if keep_edited else None,
+                ).returning(ProductDB.__table__.c.barcode, ProductDB.__table__.c.id)
+                result = await session.execute(stmt)
+                ids.update({barcode: product_id for barcode, product_id in result.all()})
+            await session.commit()
+        for row in rows:
+            await product_cache.invalidate(row["barcode"])
+        return ids
+
+    async def create_import_job(self, job_id: str, barcodes: List[str]) -> None:
+        async with self.session() as session:
+            session.add(ImportJobDB(id=job_id, status="running", barcodes=barcodes, results={}))
+            await session.commit()
+
+    async def claim_import_job(self, job_id: str, stale_after: float) -> bool:
+        """
+        Атомарно забирает задачу себе: отложенную (queued) или running,
+        чей воркер давно не отмечался. Из нескольких воркеров задачу получит один.
+        """
+        async with self.session() as session:
+            result = await session.execute(
+                ImportJobDB.__table__.update()
+                .where(
+                    ImportJobDB.id == job_id,
+                    or_(
+                        ImportJobDB.status == "queued",
+                        and_(
+                            ImportJobDB.status == "running",
+                            ImportJobDB.updated_at < func.now() - timedelta(seconds=stale_after),
+                        ),
+                    ),
+                )
+                .values(status="running")
+                .returning(ImportJobDB.id)
+            )
+            claimed = result.first() is not None
+            await session.commit()
+            return claimed
+
+    async def touch_import_job(self, job_id: str) -> None:
+        async with self.session() as session:
+            await session.execute(
+                ImportJobDB.__table__.update()
+                .where(ImportJobDB.id == job_id)
+                .values(updated_at=func.now())
+            )
+            await session.commit()
+
+    async def get_import_job(self, job_id: str) -> Optional[ImportJobDB]:
+        async with self.session() as session:
+            result = await session.execute(select(ImportJobDB).filter(ImportJobDB.id == job_id))
+            return result.scalars().first()
+
+    async def get_unfinished_import_jobs(self) -> List[ImportJobDB]:
+        async with self.session() as session:
+            result = await session.execute(
+                select(ImportJobDB).filter(ImportJobDB.status.in_(("queued", "running")))
+            )
+            return list(result.scalars().all())
+
+    async def update_import_job(self, job_id: str, status: str, results: dict) -> None:
+        async with self.session() as session:
+            await session.execute(
+                ImportJobDB.__table__.update()
+                .where(ImportJobDB.id == job_id)
+                .values(status=status, results=results)
+            )
+            await session.commit()
 
-    async def upsert_data(self, product: Product) -> None:
-        async with async_session() as session:
-            result = await session.execute(select(ProductDB).filter_by(barcode=product.barcode))
-            existing = result.scalars().first()
-            if existing:
-                existing.product_name = product.product_name
-                existing.manufacturer = product.manufacturer
-                existing.score = product.score
-                existing.nutrition = product.nutrition
-                existing.allergens = product.allergens
-                existing.extra = product.extra
-                existing.image_front = product.image_front
-                existing.image_ingredients = product.image_ingredients
-                existing.tags = product.tags
-                existing.status = product.status or ProductStatus.pending
-                session.add(existing)
-            else:
-                db_product = ProductDB(
-                    barcode=product.barcode,
-                    product_name=product.product_name,
-                    manufacturer=product.manufacturer,
-                    score=product.score,
-                    nutrition=product.nutrition,
-                    allergens=product.allergens,
-                    extra=product.extra,
-                    image_front=product.image_front,
-                    image_ingredients=product.image_ingredients,
-                    tags=product.tags,
-                    status=product.status or ProductStatus.pending,
+    async def update_import_job_analysis(self, job_id: str, analysis: Optional[dict]) -> None:
+        async with self.session() as session:
+            await session.execute(
+                ImportJobDB.__table__.update()
+                .where(ImportJobDB.id == job_id)
+                .values(analysis=analysis)
+            )
+            await session.commit()
+
+    async def record_scans(self, counts: Dict[str, int]) -> None:
+        # Счётчики копятся в памяти и сбрасываются пачкой — без записи в БД на каждый скан
+        if not counts:
+            return
+        table = ProductDB.__table__
+        stmt = (
+            table.update()
+            .where(table.c.barcode == bindparam("b_barcode"))
+            .values(scan_count=table.c.scan_count + bindparam("b_count"), last_scanned_at=func.now())
+        )
+        async with self.session() as session:
+            await session.execute(stmt, [{"b_barcode": barcode, "b_count": count} for barcode, count in counts.items()])
+            await session.commit()
+
+    async def refresh_candidates(self, limit: int, max_age: float, retry_after: float) -> List[Tuple[str, float]]:
+        """
+        Товары, которые стоит перепроверить в источниках, по убыванию приоритета:
+        пустые (barcode-list), ожидающие модерации, устаревшие; популярные — раньше.
+        Исправленные в панели не берутся. Каждая группа выбирается своим запросом по индексу
+        (название, частичные индексы по статусу и fetched_at) с LIMIT, приоритет считается
+        только для отобранных строк, а не для всей таблицы.
+        """
+        table = ProductDB.__table__
+        empty = empty_name_condition()
+        # Статус — литералом, а не параметром: иначе планировщик не сопоставит условие с частичным индексом
+        pending = text("products.status = 'pending'")
+        stale = table.c.fetched_at < func.now() - timedelta(seconds=max_age)
+        eligible = (
+            table.c.edited_at.is_(None),
+            table.c.status.notin_([ProductStatus.rejected, ProductStatus.deleted]),
+            or_(
+                table.c.refresh_attempted_at.is_(None),
+                table.c.refresh_attempted_at < func.now() - timedelta(seconds=retry_after),
+            ),
+        )
+        groups = [
+            select(table.c.id).where(condition, *eligible).order_by(table.c.scan_count.desc()).limit(limit)
+            for condition in (empty, pending, stale)
+        ]
+        candidates = union(*groups).subquery()
+        priority = (
+            case((empty, 3.0), else_=0.0)
+            + case((pending, 2.0), else_=0.0)
+            + func.ln(1 + table.c.scan_count)
+        ).label("priority")
+        stmt = (
+            select(table.c.barcode, priority)
+            .where(table.c.id.in_(select(candidates.c.id)))
+            .order_by(priority.desc())
+            .limit(limit)
+        )
+        async with self.engine.connect() as conn:
+            result = await conn.execute(stmt)
+            return [(barcode, float(value)) for barcode, value in result.all()]
+
+    async def claim_refresh(self, barcode: str, retry_after: float) -> bool:
+        # Атомарная отметка попытки: из нескольких воркеров товар обновит один, повтор — не раньше retry_after
+        table = ProductDB.__table__
+        async with self.session() as session:
+            result = await session.execute(
+                table.update()
+                .where(
+                    table.c.barcode == barcode,
+                    table.c.status.notin_([ProductStatus.rejected, ProductStatus.deleted]),
+                    table.c.edited_at.is_(None),
+                    or_(
+                        table.c.refresh_attempted_at.is_(None),
+                        table.c.refresh_attempted_at < func.now() - timedelta(seconds=retry_after),
+                    ),
                 )
-                session.add(db_product)
+                .values(refresh_attempted_at=func.now())
+                .returning(table.c.id)
+            )
+            claimed = result.first() is not None
+            await session.commit()
+            return claimed
+
+    async def mark_fetched(self, barcode: str) -> None:
+        # Источники перепроверены, но лучших данных нет — храним прежнюю копию
+        table = ProductDB.__table__
+        async with self.session() as session:
+            await session.execute(table.update().where(table.c.barcode == barcode).values(fetched_at=func.now()))
             await session.commit()
 
     async def get_db_product(self, barcode: str) -> Optional[ProductDB]:
-        async with async_session() as session:
+        async with self.session() as session:
             result = await session.execute(select(ProductDB).filter(ProductDB.barcode == barcode))
             return result.scalars().first()
 
@@ -1,18 +1,63 @@
+import os
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from database import db
-from routes import panel_router, scanner_router
+from database import db, IS_PRODUCTION, WEB_CONCURRENCY
+from routes import metrics_router, panel_router, scanner_router
+from routes.scanner import limit_upload_body
+from services.parser import parser
+from services.media import media
+from services.analyzer import analyzer
+from services.analysis_cache import analysis_cache
+from services.cache import product_cache
+from services.importer import importer
+from services.refresher import refresher
+from services.off_mirror import off_mirror
+from services.metrics import monitor_event_loop, server_timing
 
 
-app = FastAPI(title="Yumi API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Выполняется в каждом воркере: пулы соединений и клиенты у каждого процесса свои
+    await db.init_db()
+    await parser.startup()
+    await product_cache.startup()
+    await importer.resume_jobs()
+    await refresher.startup()
+    loop_monitor = asyncio.create_task(monitor_event_loop())
+    yield
+    loop_monitor.cancel()
+    await refresher.shutdown()
+    await importer.shutdown()
+    await parser.shutdown()
+    media.shutdown()
+    await analyzer.shutdown()
+    analysis_cache.close()
+    off_mirror.close()
+    await product_cache.shutdown()
+    await db.shutdown()
+
+
+app = FastAPI(title="Yumi API", lifespan=lifespan)
 
 app.include_router(scanner_router)
 app.include_router(panel_router)
-
-@app.on_event("startup")
-async def startup_event():
-    await db.init_db()
+app.include_router(metrics_router)
+app.middleware("http")(limit_upload_body)
+app.middleware("http")(server_timing)
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    if IS_PRODUCTION:
+        # Несколько процессов; на SIGTERM uvicorn дожидается текущих запросов
+        uvicorn.run(
+            "main:app",
+            host=os.getenv("HOST", "0.0.0.0"),
+            port=int(os.getenv("PORT", "8000")),
+            workers=WEB_CONCURRENCY,
+            timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30")),
+            proxy_headers=True,
+        )
+    else:
+        uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -1,8 +1,9 @@
-from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, String, Integer, Float, JSON, Index, Enum
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import declarative_base, deferred
+from sqlalchemy import Column, String, Integer, Float, JSON, Index, Enum, DateTime, Computed, func, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from pydantic import BaseModel
 from typing import Optional, Union
+from datetime import datetime
 import enum
 
 Base = declarative_base()
@@ -13,10 +14,24 @@ class ProductStatus(enum.Enum):
     rejected = 'rejected'
     deleted = 'deleted'
 
+# Полнотекстовый индекс: название (вес A), производитель (B), состав из extra (C)
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('russian', coalesce(product_name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(manufacturer, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce(extra ->> 'ingredients', '')), 'C')"
+)
+
 class ProductDB(Base):
     __tablename__ = "products"
     __table_args__ = (
         Index('idx_products_tags_gin', 'tags', postgresql_using='gin'),
+        # Для фильтра по префиксу названия (LIKE 'abc%') в панели
+        Index('idx_products_name_prefix', 'product_name', postgresql_ops={'product_name': 'text_pattern_ops'}),
+        Index('idx_products_search_gin', 'search_vector', postgresql_using='gin'),
+        Index('idx_products_name_trgm', 'product_name', postgresql_using='gin', postgresql_ops={'product_name': 'gin_trgm_ops'}),
+        # Выборка кандидатов фонового обновления: устаревшие и ожидающие модерации, без правок админа
+        Index('idx_products_refresh_stale', 'fetched_at', postgresql_where=text("edited_at IS NULL")),
+        Index('idx_products_refresh_pending', 'scan_count', postgresql_where=text("status = 'pending' AND edited_at IS NULL")),
     )
     id = Column(Integer, primary_key=True, autoincrement=True)
     product_name = Column(String, index=True)
@@ -30,6 +45,28 @@ class ProductDB(Base):
     image_ingredients = Column(String, nullable=True)
     tags = Column(JSONB, nullable=True)
     status = Column(Enum(ProductStatus), default=ProductStatus.pending, nullable=False)
+    # Считается самим Postgres при каждой записи, в ORM не загружается без нужды
+    search_vector = deferred(Column(TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True)))
+    # Свежесть и популярность для фонового обновления (services/refresher.py)
+    fetched_at = Column(DateTime(timezone=True), nullable=True)
+    analyzed_at = Column(DateTime(timezone=True), nullable=True)
+    scan_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_scanned_at = Column(DateTime(timezone=True), nullable=True)
+    refresh_attempted_at = Column(DateTime(timezone=True), nullable=True)
+    # Правка в панели: такие товары фоновое обновление не трогает
+    edited_at = Column(DateTime(timezone=True), nullable=True)
+
+class ImportJobDB(Base):
+    __tablename__ = "import_jobs"
+    id = Column(String, primary_key=True)
+    status = Column(String, nullable=False, default="queued")
+    barcodes = Column(JSON, nullable=False)
+    results = Column(JSON, nullable=False, default=dict)
+    # Пакетный анализ (IMPORT_ANALYSIS_MODE=batch): собранные данные товаров и отправленные пакеты,
+    # чтобы после рестарта дождаться уже оплаченных пакетов, а не отправлять заново
+    analysis = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 class Product(BaseModel):
     product_name: str
@@ -43,4 +80,24 @@ class Product(BaseModel):
     image_ingredients: Optional[str] = None
     tags: Optional[list[str]] = None
     status: Optional[ProductStatus] = None
-    model_config = {"from_attributes": True, "extra": "allow"}
\ No newline at end of file
+    model_config = {"from_attributes": True, "extra": "allow"}
+
+class ImportJob(BaseModel):
+    id: str
+    status: str
+    total: int
+    processed: int
+    ok: int
+    not_found: int
+    errors: int
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    results: Optional[dict] = None
+
+class ProductPage(BaseModel):
+    items: list[dict]
+    next_cursor: Optional[int] = None
+
+class SearchPage(BaseModel):
+    items: list[Product]
+    next_offset: Optional[int] = None
\ No newline at end of file
@@ -1,2 +1,3 @@
 from .scanner import router as scanner_router
-from .panel import router as panel_router
\ No newline at end of file
+from .panel import router as panel_router
+from .metrics import router as metrics_router
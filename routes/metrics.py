@@ -0,0 +1,58 @@
+import os
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from database import db
+from services.analyzer import analyzer
+from services.analysis_cache import analysis_cache
+from services.cache import product_cache
+from services.refresher import refresher
+from services.off_mirror import off_mirror
+from services.parser import parser
+from services.metrics import registry
+from services.locker import verify_api_key
+
+router = APIRouter(tags=["Metrics"])
+
+DB_POOL = registry.gauge("aiscan_db_pool", "Состояние пула соединений с БД", ("field",))
+PRODUCT_CACHE = registry.gauge("aiscan_product_cache", "Кэш товаров по уровням", ("tier", "field"))
+ANALYSIS_CACHE = registry.gauge("aiscan_analysis_cache", "Кэш ответов анализа", ("field",))
+OPENAI_LIMITER = registry.gauge("aiscan_openai_limiter", "Ограничитель запросов к OpenAI", ("field",))
+REFRESHER = registry.gauge("aiscan_refresher", "Фоновое обновление товаров", ("field",))
+OFF_MIRROR = registry.gauge("aiscan_off_mirror", "Локальное зеркало OpenFoodFacts", ("field",))
+UPSTREAM_BREAKER = registry.gauge(
+    "aiscan_upstream_breaker", "Размыкатели источников (state: 0 — замкнут, 1 — пробный, 2 — разомкнут)",
+    ("upstream", "field"),
+)
+PARSER_HEDGE = registry.gauge("aiscan_parser_hedge", "Дублирующие запросы к источникам", ("field",))
+
+
+@registry.collector
+def collect_service_stats() -> None:
+    for field, value in db.pool_status().items():
+        DB_POOL.set(value, field=field)
+    stats = product_cache.stats()
+    for tier in ("found", "missing", "shared"):
+        for field, value in stats[tier].items():
+            if isinstance(value, (int, float)):
+                PRODUCT_CACHE.set(value, tier=tier, field=field)
+    for field, value in analysis_cache.stats().items():
+        ANALYSIS_CACHE.set(value, field=field)
+    for field, value in {**analyzer.limiter.stats(), **analyzer.retry_budget.stats()}.items():
+        OPENAI_LIMITER.set(value, field=field)
+    for field, value in refresher.stats().items():
+        REFRESHER.set(float(value), field=field)
+    for field, value in off_mirror.stats().items():
+        OFF_MIRROR.set(float(value), field=field)
+    stats = parser.stats()
+    for upstream, breaker in stats["breakers"].items():
+        for field, value in breaker.items():
+            UPSTREAM_BREAKER.set(value, upstream=upstream, field=field)
+    for field, value in stats["hedge"].items():
+        PARSER_HEDGE.set(float(value), field=field)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(
+    api_key: None = Depends(lambda x_api_admin_key: verify_api_key(os.getenv("API_ADMIN_KEY"), x_api_admin_key))
+):
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,13 +1,20 @@
-from fastapi import APIRouter, HTTPException, Header, Depends, Query, Body
-from typing import List, Dict, Optional, Union
-from database import db, Product, ProductDB, async_session
+from fastapi import APIRouter, HTTPException, Depends, Query, Body
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Union
+from database import db, Product, ProductStatus, async_session, PRODUCT_FIELDS
+from models import ImportJob, ProductPage
+import json
 import os
 from services.locker import verify_api_key
-from sqlalchemy import select
 from services.parser import parser
-import requests
-import asyncio
+from datetime import datetime, timezone
 from services.analyzer import analyzer
+from services.cache import product_cache
+from services.analysis_cache import analysis_cache
+from services.importer import importer
+from services.refresher import refresher
+from services.off_mirror import off_mirror
+from services.images import IMAGES_DIR, public_url
 from pydantic import BaseModel
 
 router = APIRouter(tags=["Panel"])
@@ -26,11 +33,87 @@ class ProductUpdate(BaseModel):
     class Config:
         extra = "allow"
 
-@router.get("/products", response_model=List[Product])
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    selected = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in PRODUCT_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(PRODUCT_FIELDS)}."
+        )
+    return selected
+
+def encode_row(row: dict) -> dict:
+    if isinstance(row.get("status"), ProductStatus):
+        row["status"] = row["status"].value
+    return row
+
+@router.get("/products", response_model=ProductPage)
 async def panel_get_all_products(
+    cursor: Optional[int] = Query(None, description="id последнего товара предыдущей страницы"),
+    limit: int = Query(100, ge=1, le=1000),
+    status: Optional[ProductStatus] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    tags: Optional[List[str]] = Query(None),
+    name_prefix: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Список полей через запятую"),
+    api_key: None = Depends(lambda x_api_admin_key: verify_api_key(os.getenv("API_ADMIN_KEY"), x_api_admin_key))
+):
+    items, next_cursor = await db.list_products(
+        after_id=cursor,
+        limit=limit,
+        fields=parse_fields(fields),
+        status=status,
+        min_score=min_score,
+        max_score=max_score,
+        tags=tags,
+        name_prefix=name_prefix,
+    )
+    return ProductPage(items=[encode_row(item) for item in items], next_cursor=next_cursor)
+
+@router.get("/products/export")
+async def panel_export_products(
+    status: Optional[ProductStatus] = None,
+    min_score: Optional[float] = None,
+    max_score: Optional[float] = None,
+    tags: Optional[List[str]] = Query(None),
+    name_prefix: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Список полей через запятую"),
+    api_key: None = Depends(lambda x_api_admin_key: verify_api_key(os.getenv("API_ADMIN_KEY"), x_api_admin_key))
+):
+    # NDJSON: по одному товару на строку, строки читаются с сервера курсором
+    selected = parse_fields(fields)
+
+    async def lines():
+        async for row in db.stream_products(
+            fields=selected,
+            status=status,
+            min_score=min_score,
+            max_score=max_score,
+            tags=tags,
+            name_prefix=name_prefix,
+        ):
+            yield json.dumps(encode_row(row), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/stats")
+async def panel_get_stats(
     api_key: None = Depends(lambda x_api_admin_key: verify_api_key(os.getenv("API_ADMIN_KEY"), x_api_admin_key))
 ):
-    return await db.get_all_data()
+    return {
+        "db_pool": db.pool_status(),
+        "product_cache": product_cache.stats(),
+        "openai_limiter": analyzer.limiter.stats(),
+        "openai_retry_budget": analyzer.retry_budget.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "refresher": refresher.stats(),
+        "off_mirror": off_mirror.stats(),
+        "upstreams": parser.stats(),
+    }
 
 @router.get("/products/{barcode}", response_model=Product)
 async def panel_get_product(barcode: str, api_key: None = Depends(lambda x_api_admin_key: verify_api_key(os.getenv("API_ADMIN_KEY"), x_api_admin_key))):
@@ -39,74 +122,36 @@ async def panel_get_product(barcode: str, api_key: None = Depends(lambda x_api_a
         raise HTTPException(status_code=404, detail="Продукт не найден")
     return product
 
-@router.post("/products/batch-roskachestvo")
+@router.post("/products/batch-roskachestvo", response_model=ImportJob)
 async def batch_import_roskachestvo(
     barcodes: List[str] = Body(..., embed=True),
     api_key: None = Depends(lambda x_api_admin_key: verify_api_key(os.getenv("API_ADMIN_KEY"), x_api_admin_key))
-) -> Dict[str, str]:
-    results = {}
+):
     for barcode in barcodes:
         parser.validate_barcode(barcode)
-        try:
-            roskachestvo_data = await parser.fetch_from_roskachestvo(barcode)
-            if not roskachestvo_data or not roskachestvo_data.get("product", {}).get("title"):
-                results[barcode] = "not_found"
-                continue
-            image_url = roskachestvo_data["product"].get("thumbnail")
-            local_image_url = None
-            if image_url:
-                local_image_url = await asyncio.to_thread(download_and_save_image_sync, image_url, barcode, "roskachestvo")
-            analysis = await analyzer.analyze_data(roskachestvo_data["product"])
-            new_product = Product(
-                barcode=barcode,
-                product_name=analysis.get("product_name", roskachestvo_data["product"].get("title", "No Product Name")),
-                manufacturer=analysis.get("manufacturer", roskachestvo_data["product"].get("manufacturer")),
-                score=analysis.get("overall_score", roskachestvo_data["product"].get("total_rating")),
-                nutrition=analysis.get("nutrition"),
-                allergens=analysis.get("allergens"),
-                image_front=local_image_url or roskachestvo_data["product"].get("thumbnail"),
-                image_ingredients=None,
-                tags=analysis.get("tags"),
-                status="verified",
-                extra={
-                    "description": roskachestvo_data["product"].get("description"),
-                    "category_name": roskachestvo_data["product"].get("category_name"),
-                    "ingredients": analysis.get("ingredients"),
-                    "explanation_score": analysis.get("explanation_score"),
-                    "harmful_components": analysis.get("harmful_components"),
-                    "recommendedfor": analysis.get("recommendedfor"),
-                    "frequency": analysis.get("frequency"),
-                    "alternatives": analysis.get("alternatives"),
-                    "roskachestvo_recommendations": roskachestvo_data.get("recommendations", [])
-                }
-            )
-            await db.upsert_data(new_product)
-            results[barcode] = "ok"
-            await asyncio.sleep(1)  # чтобы не получить бан от Роскачества
-        except Exception as e:
-            results[barcode] = f"error: {e}"
-    return results
+    # Импорт идёт в фоне, прогресс — через GET /products/batch-roskachestvo/{job_id}
+    job_id = await importer.create_job(barcodes)
+    return importer.describe(await db.get_import_job(job_id))
+
+@router.get("/products/batch-roskachestvo/{job_id}", response_model=ImportJob)
+async def batch_import_progress(
+    job_id: str,
+    api_key: None = Depends(lambda x_api_admin_key: verify_api_key(os.getenv("API_ADMIN_KEY"), x_api_admin_key))
+):
+    job = await db.get_import_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача импорта не найдена")
+    return importer.describe(job)
 
-def download_and_save_image_sync(url: str, barcode: str, suffix: str = "roskachestvo") -> str:
-    filename = f"{barcode}_{suffix}.jpg"
-    filepath = os.path.join("static/images", filename)
-    try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.get(url, timeout=10, headers=headers)
-        if response.status_code == 200:
-            content_type = response.headers.get("content-type", "")
-            if not any(img in content_type for img in ("image/jpeg", "image/png", "image/webp")):
-                print(f"Файл по ссылке {url} не является изображением (jpeg/png/webp), content-type: {content_type}")
-                return None
-            os.makedirs("static/images", exist_ok=True)
-            with open(filepath, "wb") as f:
-                f.write(response.content)
-            return f"https://iscan.store/static/images/{filename}"
-        else:
-            print(f"Не удалось скачать изображение: {url}, статус {response.status_code}")
-    except Exception as e:
-        print(f"Ошибка при скачивании изображения: {e}")
-    return None
+@router.get("/products/batch-roskachestvo/{job_id}/result", response_model=ImportJob)
+async def batch_import_result(
+    job_id: str,
+    api_key: None = Depends(lambda x_api_admin_key: verify_api_key(os.getenv("API_ADMIN_KEY"), x_api_admin_key))
+):
+    job = await db.get_import_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача импорта не найдена")
+    return importer.describe(job, with_results=True)
 
 @router.patch("/products/{barcode}", response_model=Product)
 async def panel_update_product(
@@ -123,9 +168,12 @@ async def panel_update_product(
     for key, value in update_data.items():
         print(f"DEBUG setattr: {key} = {value}")  # debug print
         setattr(db_product, key, value)
+    # Отметка правки: фоновое обновление такой товар больше не перезаписывает
+    db_product.edited_at = datetime.now(timezone.utc)
     async with async_session() as session:
         session.add(db_product)
         await session.commit()
+    await product_cache.invalidate(barcode)
     return Product.model_validate(db_product)
 
 @router.delete("/products/{barcode}")
@@ -139,14 +187,15 @@ async def panel_delete_product(
         raise HTTPException(status_code=404, detail="Продукт не найден")
     # Удалить фото, если есть
     for img_url in [product.image_front, product.image_ingredients]:
-        if img_url and img_url.startswith("https://iscan.store/static/images/"):
-            filename = img_url.split("/static/images/")[-1]
-            filepath = os.path.join("static/images", filename)
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except Exception as e:
-                    print(f"Ошибка при удалении файла {filepath}: {e}")
+        if img_url and img_url.startswith(public_url("")):
+            filename = os.path.basename(img_url[len(public_url("")):])
+            filepath = os.path.join(IMAGES_DIR, filename)
+            for path in (filepath, f"{filepath}.meta"):
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except Exception as e:
+                        print(f"Ошибка при удалении файла {path}: {e}")
     # Удалить продукт из базы
     await db.delete_data(barcode)
     return {"status": "success", "message": f"Продукт {barcode} и связанные фото удалены"} 
\ No newline at end of file
@@ -1,130 +1,144 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Header, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, UploadFile, File, Header, Depends, Request, Query
+from typing import List, Optional
 import base64
 import os
+import tempfile
 from database import db, Product, ProductStatus
+from models import SearchPage
 from services.analyzer import analyzer
 from services.parser import parser
 from services.media import media
 from services.locker import verify_api_key
-import requests
+from services.cache import product_cache, EncodedProduct
+from services.images import IMAGES_DIR, public_url, sniff_image_format
+from services.singleflight import SingleFlight
+from services.refresher import refresher
+from services import products
 import asyncio
+from fastapi.responses import JSONResponse, Response
 
 router = APIRouter(tags=["Scanner"])
 
 MAX_FILE_SIZE_MB = 10
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 ALLOWED_EXTENSIONS = {"jpeg", "jpg", "png", "webp"}
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Две фотографии плюс запас на multipart-заголовки
+MAX_UPLOAD_BODY_BYTES = 2 * MAX_FILE_SIZE_BYTES + 1024 * 1024
 
-def download_and_save_image_sync(url: str, barcode: str, suffix: str = "roskachestvo") -> str:
-    filename = f"{barcode}_{suffix}.jpg"
-    filepath = os.path.join("static/images", filename)
+# Одновременные холодные запросы одного штрихкода выполняют цепочку источников один раз
+lookups = SingleFlight()
+
+async def limit_upload_body(request: Request, call_next):
+    # Отсекаем заведомо слишком большие загрузки по Content-Length ещё до разбора multipart
+    if request.method == "POST" and request.url.path.startswith("/update/"):
+        declared = request.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_BODY_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Слишком большой запрос. Максимальный размер файла: {MAX_FILE_SIZE_MB}MB."},
+            )
+    return await call_next(request)
+
+async def spool_upload(image: UploadFile) -> str:
+    """
+    Читает загруженный файл кусками во временный файл, обрывая чтение
+    при превышении лимита и проверяя сигнатуру по первым байтам.
+    Возвращает путь к временному файлу.
+    """
+    if image.size is not None and image.size > MAX_FILE_SIZE_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Файл {image.filename} слишком большой. Максимальный размер: {MAX_FILE_SIZE_MB}MB."
+        )
+    fd, tmp_path = tempfile.mkstemp(prefix="upload_", suffix=".part")
     try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        response = requests.get(url, timeout=10, headers=headers)
-        if response.status_code == 200:
-            content_type = response.headers.get("content-type", "")
-            if not any(img in content_type for img in ("image/jpeg", "image/png", "image/webp")):
-                print(f"Файл по ссылке {url} не является изображением (jpeg/png/webp), content-type: {content_type}")
-                return None
-            os.makedirs("static/images", exist_ok=True)
-            with open(filepath, "wb") as f:
-                f.write(response.content)
-            return f"https://iscan.store/static/images/{filename}"
-        else:
-            print(f"Не удалось скачать изображение: {url}, статус {response.status_code}")
-    except Exception as e:
-        print(f"Ошибка при скачивании изображения: {e}")
-    return None
+        size = 0
+        head = b""
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await image.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Файл {image.filename} слишком большой. Максимальный размер: {MAX_FILE_SIZE_MB}MB."
+                    )
+                if len(head) < 12:
+                    head += chunk[:12 - len(head)]
+                f.write(chunk)
+        if sniff_image_format(head) is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Файл {image.filename} не является изображением. Разрешены только: {', '.join(ALLOWED_EXTENSIONS)}."
+            )
+        return tmp_path
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Cache-Control по статусу: проверенные товары меняются редко, остальные клиент перепроверяет по ETag
+CACHE_CONTROL = {
+    ProductStatus.verified: f"private, max-age={int(os.getenv('FIND_MAX_AGE_VERIFIED', '86400'))}",
+    ProductStatus.pending: "private, no-cache",
+}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def product_response(entry: EncodedProduct, request: Request) -> Response:
+    # Отдаём заранее сериализованный JSON: без повторной валидации через response_model
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": CACHE_CONTROL.get(entry.product.status, "private, no-cache"),
+    }
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 @router.get("/find/{barcode}", response_model=Product)
 async def find_product(
     barcode: str,
+    request: Request,
     api_key: None = Depends(lambda x_api_key: verify_api_key(os.getenv("API_SECRET_KEY"), x_api_key))
 ):
     parser.validate_barcode(barcode)
-    existing = await db.find_data(barcode)
+    existing = await db.find_encoded(barcode)
     if existing:
-        return existing
-    # Сначала пробуем Роскачество
-    roskachestvo_data = await parser.fetch_from_roskachestvo(barcode)
-    if roskachestvo_data and roskachestvo_data.get("product", {}).get("title"):
-        image_url = roskachestvo_data["product"].get("thumbnail")
-        local_image_url = None
-        if image_url:
-            local_image_url = await asyncio.to_thread(download_and_save_image_sync, image_url, barcode, "roskachestvo")
-        analysis = await analyzer.analyze_data(roskachestvo_data["product"])
-        new_product = Product(
-            barcode=barcode,
-            product_name=analysis.get("product_name", roskachestvo_data["product"].get("title", "No Product Name")),
-            manufacturer=analysis.get("manufacturer", roskachestvo_data["product"].get("manufacturer")),
-            score=analysis.get("overall_score", roskachestvo_data["product"].get("total_rating")),
-            nutrition=analysis.get("nutrition"),
-            allergens=analysis.get("allergens"),
-            image_front=local_image_url or roskachestvo_data["product"].get("thumbnail"),
-            image_ingredients=None,
-            tags=analysis.get("tags"),
-            status=ProductStatus.verified,
-            extra={
-                "description": roskachestvo_data["product"].get("description"),
-                "category_name": roskachestvo_data["product"].get("category_name"),
-                "ingredients": analysis.get("ingredients"),
-                "explanation_score": analysis.get("explanation_score"),
-                "harmful_components": analysis.get("harmful_components"),
-                "recommendedfor": analysis.get("recommendedfor"),
-                "frequency": analysis.get("frequency"),
-                "alternatives": analysis.get("alternatives"),
-                "roskachestvo_recommendations": roskachestvo_data.get("recommendations", [])
-            }
-        )
-        await db.save_data(new_product)
-        return new_product
-    # Если нет в Роскачестве — пробуем OpenFoodFacts
-    details = await parser.fetch_from_openfoodfacts(barcode)
-    if details and details.get("product_name") and details.get("ingredients_text"):
-        analysis = await analyzer.analyze_data(details)
-        new_product = Product(
-            barcode=barcode,
-            product_name=analysis.get("product_name", "No Product Name"),
-            manufacturer=analysis.get("manufacturer"),  
-            score=analysis.get("overall_score"),
-            nutrition=analysis.get("nutrition"),
-            allergens=analysis.get("allergens"),
-            image_front=details.get("image_front_url"),
-            image_ingredients=details.get("image_ingredients_url"),
-            tags=analysis.get("tags"),
-            status=ProductStatus.verified,
-            extra={
-                "ingredients": analysis.get("ingredients"),
-                "explanation_score": analysis.get("explanation_score"),
-                "harmful_components": analysis.get("harmful_components"),
-                "recommendedfor": analysis.get("recommendedfor"),
-                "frequency": analysis.get("frequency"),
-                "alternatives": analysis.get("alternatives"),
-            }
-        )
-        await db.save_data(new_product)
-        return new_product
-    # Если не найдено ни в Роскачестве, ни в OpenFoodFacts — ищем в barcode-list
-    exists = await parser.product_exists_in_barcode_lists(barcode)
-    if not exists:
+        # Отдаём сохранённую копию сразу; устаревшие и пустые товары обновятся в фоне
+        refresher.record_scan(existing.product)
+        return product_response(existing, request)
+    # Недавно уже искали везде и не нашли — не гоняем цепочку источников повторно
+    if product_cache.is_missing(barcode):
         raise HTTPException(status_code=404, detail="Продукт с таким штрихкодом не найден ни в одной базе")
-    # Если найден только в barcode-list, сохраняем только barcode и возвращаем null-данные
-    empty_product = Product(
-        barcode=barcode,
-        product_name="",
-        manufacturer=None,
-        score=None,
-        nutrition=None,
-        allergens=None,
-        image_front=None,
-        image_ingredients=None,
-        tags=None,
-        status=None,
-        extra=None
-    )
-    await db.save_data(empty_product)
-    return empty_product
+    product = await lookups.do(barcode, lambda: lookup_product(barcode))
+    return product_response(EncodedProduct(product), request)
+
+async def lookup_product(barcode: str) -> Product:
+    # Источники опрашиваются по приоритету: Роскачество > OpenFoodFacts > barcode-list
+    found = await parser.find_source(barcode)
+    if found is None:
+        product_cache.mark_missing(barcode)
+        raise HTTPException(status_code=404, detail="Продукт с таким штрихкодом не найден ни в одной базе")
+    source, data = found
+    new_product = await products.build(barcode, source, data)
+    # Если за время поиска товар уже появился в БД (загрузка фото, фоновое обновление) — отдаём его
+    return await db.save_data(new_product, analyzed=source != "barcode_list")
+
+@router.get("/search", response_model=SearchPage)
+async def search_products(
+    q: Optional[str] = Query(None, min_length=2, max_length=200),
+    tags: Optional[List[str]] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    api_key: None = Depends(lambda x_api_key: verify_api_key(os.getenv("API_SECRET_KEY"), x_api_key))
+):
+    if not q and not tags:
+        raise HTTPException(status_code=400, detail="Укажите строку поиска q или теги.")
+    items, next_offset = await db.search_products(query=q, tags=tags, limit=limit, offset=offset)
+    return SearchPage(items=items, next_offset=next_offset)
 
 @router.post("/update/{barcode}", response_model=Product)
 async def update_product(
@@ -135,33 +149,39 @@ async def update_product(
     parser.validate_barcode(barcode)
     if len(images) != 2:
         raise HTTPException(status_code=400, detail="Нужно загрузить ровно 2 фотографии: фронт и состав.")
-    image_paths = []
-    base64_images = []
-    os.makedirs("static/images", exist_ok=True)
-    for i, image in enumerate(images):
-        contents = await image.read()
-        if len(contents) > MAX_FILE_SIZE_BYTES:
-            raise HTTPException(
-                status_code=413, 
-                detail=f"Файл {image.filename} слишком большой. Максимальный размер: {MAX_FILE_SIZE_MB}MB."
-            )
-        filename_lower = image.filename.lower()
+    for image in images:
+        filename_lower = (image.filename or "").lower()
         if not any(filename_lower.endswith(f".{ext}") for ext in ALLOWED_EXTENSIONS):
             raise HTTPException(
                 status_code=400,
                 detail=f"Недопустимый формат файла {image.filename}. Разрешены только: {', '.join(ALLOWED_EXTENSIONS)}."
             )
-        compressed = media.convert_to_jpeg(contents)
+    spooled = []
+    try:
+        for image in images:
+            spooled.append(await spool_upload(image))
+            await image.close()
+        # Обе фотографии перекодируются параллельно в пуле media прямо из временных файлов
+        compressed_images = await asyncio.gather(*(media.transcode(path) for path in spooled))
+    finally:
+        for path in spooled:
+            if os.path.exists(path):
+                os.remove(path)
+    image_paths = []
+    base64_images = []
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    for i, compressed in enumerate(compressed_images):
         suffix = "front" if i == 0 else "ingredients"
-        filename = f"{barcode}_{suffix}.jpg"
-        filepath = os.path.join("static/images", filename)
+        filename = f"{barcode}_{suffix}.{media.extension}"
+        filepath = os.path.join(IMAGES_DIR, filename)
         with open(filepath, "wb") as f:
             f.write(compressed)
-        url_path = f"https://iscan.store/static/images/{filename}"
+        url_path = public_url(filename)
         image_paths.append(url_path)
-        encoded = base64.b64encode(compressed).decode('utf-8')
-        base64_images.append(encoded)
-    analysis = await analyzer.analyze_image(barcode, base64_images)
+        # base64 считается один раз из итогового сжатого буфера, сам буфер сразу отпускаем
+        base64_images.append(base64.b64encode(compressed).decode('ascii'))
+        compressed_images[i] = None
+    analysis = await analyzer.analyze_image(barcode, base64_images, media.mime_type)
     new_product = Product(
         barcode=barcode,
         product_name=analysis.get("product_name", "No Product Name"),
@@ -182,5 +202,6 @@ async def update_product(
             "alternatives": analysis.get("alternatives")
         }
     )
-    await db.upsert_data(new_product)
+    # Данные получены с фотографий, а не из источника — fetched_at не трогаем
+    await db.upsert_data(new_product, fetched=False)
     return new_product 
\ No newline at end of file
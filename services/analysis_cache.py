@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+# Время доступа пишется пачками: не чаще раза в TOUCH_FLUSH_INTERVAL или по TOUCH_FLUSH_SIZE ключей
+TOUCH_FLUSH_INTERVAL = 30.0
+TOUCH_FLUSH_SIZE = 256
+EVICT_BATCH = 200
+
+
+def canonicalize(data: Any) -> Any:
+    # Нормализация входа: одинаковые по смыслу данные дают одинаковый ключ
+    if isinstance(data, dict):
+        return {str(k): canonicalize(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [canonicalize(v) for v in data]
+    if isinstance(data, str):
+        return " ".join(data.split())
+    return data
+
+
+class AnalysisCache:
+    """
+    Постоянный кэш результатов LLM-анализа на SQLite.
+    Ключ — хэш (модель, версия инструкций, нормализованный вход);
+    при превышении ANALYSIS_CACHE_MAX_BYTES вытесняются давно не читанные записи.
+    Общий размер ведут триггеры в таблице meta — он верен и при нескольких воркерах на одном файле.
+    """
+    def __init__(self):
+        self.path = os.getenv("ANALYSIS_CACHE_PATH", "cache/analysis.sqlite3")
+        self.max_bytes = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.enabled = self.max_bytes > 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._touched_flushed_at = time.monotonic()
+
+    def key(self, model: str, instructions_version: str, data: Any) -> str:
+        canonical = json.dumps(canonicalize(data), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(f"{model}\n{instructions_version}\n{canonical}".encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_accessed_at ON analysis (accessed_at)")
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            for trigger, event, delta in (
+                ("analysis_size_insert", "AFTER INSERT", "new.size"),
+                ("analysis_size_delete", "AFTER DELETE", "-old.size"),
+                ("analysis_size_update", "AFTER UPDATE OF size", "new.size - old.size"),
+            ):
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {trigger} {event} ON analysis BEGIN "
+                    f"UPDATE meta SET value = value + {delta} WHERE name = 'total_bytes'; END"
+                )
+            # Файл, созданный до появления meta: один раз считаем размер целиком
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (name, value) "
+                "SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM analysis"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _flush_touched(self, conn: sqlite3.Connection) -> None:
+        # Вызывается под self._lock внутри открытой транзакции
+        if self._touched:
+            conn.executemany(
+                "UPDATE analysis SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._touched.items()],
+            )
+            self._touched.clear()
+        self._touched_flushed_at = time.monotonic()
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM analysis WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._touched[key] = time.time()
+            if (len(self._touched) >= TOUCH_FLUSH_SIZE
+                    or time.monotonic() - self._touched_flushed_at >= TOUCH_FLUSH_INTERVAL):
+                self._flush_touched(conn)
+                conn.commit()
+            return json.loads(row[0])
+
+    def _set(self, key: str, value: dict) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            conn = self._connect()
+            self._touched.pop(key, None)
+            conn.execute(
+                "INSERT INTO analysis (key, value, size, accessed_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "accessed_at = excluded.accessed_at",
+                (key, payload, len(payload.encode("utf-8")), time.time()),
+            )
+            total = conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+            if total > self.max_bytes:
+                # Перед вытеснением сохраняем накопленные обращения, чтобы не выкинуть читаемое.
+                # Освобождаем до 90% лимита, читая кандидатов пачками по индексу accessed_at
+                self._flush_touched(conn)
+                target = int(self.max_bytes * 0.9)
+                while total > target:
+                    # Берём старейшие записи по индексу и удаляем ровно столько, сколько нужно до цели
+                    rows = conn.execute(
+                        "SELECT key, size FROM analysis ORDER BY accessed_at LIMIT ?", (EVICT_BATCH,)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    victims = []
+                    freed = 0
+                    for victim, size in rows:
+                        if total - freed <= target:
+                            break
+                        victims.append((victim,))
+                        freed += size
+                    conn.executemany("DELETE FROM analysis WHERE key = ?", victims)
+                    self.evictions += len(victims)
+                    total = conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+            conn.commit()
+
+    async def get(self, key: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        try:
+            value = await asyncio.to_thread(self._get, key)
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Ошибка чтения кэша анализа: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: dict) -> None:
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._set, key, value)
+        except sqlite3.Error as e:
+            print(f"Ошибка записи кэша анализа: {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._flush_touched(self._conn)
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"Ошибка записи кэша анализа: {e}")
+                self._conn.close()
+                self._conn = None
+
+
+analysis_cache = AnalysisCache()
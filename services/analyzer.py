@@ -1,18 +1,42 @@
 import os
 import json
+import random
 import asyncio
-from typing import List
+import httpx
+import hashlib
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
 from dotenv import load_dotenv
-from openai import OpenAI
+from fastapi import HTTPException
+from services.limits import ConcurrencyLimiter, LimitExceeded, RetryBudget
+from services.analysis_cache import analysis_cache
+from services.metrics import timed, LLM_SECONDS, LLM_TOKENS
 
 load_dotenv()
 
 class Analyzer:
     def __init__(self):
-        OPENAI_API = os.getenv("OPENAI_API_KEY")
-        if not OPENAI_API:
-            raise ValueError("API не заданы в переменных окружения.")
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Клиент OpenAI (и сам SDK) поднимается при первом запросе к анализу, а не при импорте
+        self._client = None
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self.limiter = ConcurrencyLimiter(
+            limit=int(os.getenv("OPENAI_CONCURRENCY", "16")),
+            max_waiting=int(os.getenv("OPENAI_MAX_WAITING", "64")),
+            max_wait=float(os.getenv("OPENAI_MAX_WAIT", "10")),
+        )
+        self.retry_budget = RetryBudget(
+            ratio=float(os.getenv("OPENAI_RETRY_RATIO", "0.1")),
+            max_tokens=float(os.getenv("OPENAI_RETRY_MAX_TOKENS", "10")),
+        )
+        self.max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+        self.retry_base_delay = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+        self.retry_max_delay = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))
+        self.text_model = "gpt-4.1-nano"
+        # Пакетный режим (Batch API) для фоновых импортов: дешевле и не занимает лимиты интерактивных сканов
+        self.batch_size = int(os.getenv("OPENAI_BATCH_SIZE", "1000"))
+        self.batch_poll_interval = float(os.getenv("OPENAI_BATCH_POLL_INTERVAL", "30"))
+        self.batch_max_attempts = int(os.getenv("OPENAI_BATCH_MAX_ATTEMPTS", "3"))
+        self.batch_completion_window = os.getenv("OPENAI_BATCH_COMPLETION_WINDOW", "24h")
 
         self.instructions = (
             "You are an expert in food product analysis, like Yuka."
@@ -62,13 +86,237 @@ class Analyzer:
             "In 'tags', include 3–6 useful labels like: 'продукты питания', 'гигиена', 'говядина', 'без глютена', 'полуфабрикаты'."
             "Before returning the final JSON, carefully review all values. Avoid extreme scores unless well justified, and ensure overall consistency in the output."
         )
+        # Версия инструкций входит в ключ кэша анализа: правка промпта инвалидирует старые ответы
+        self.instructions_version = hashlib.sha256(self.instructions.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def client(self):
+        if self._client is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                print("OPENAI_API_KEY не задан в переменных окружения")
+                raise HTTPException(status_code=503, detail="Сервис анализа не настроен")
+            from openai import AsyncOpenAI
+            # Собственный пул соединений к OpenAI; повторы делаем сами, с учётом бюджета
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "50")),
+                    max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+                ),
+                timeout=httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "60")), connect=5.0),
+            )
+            self._client = AsyncOpenAI(api_key=api_key, http_client=self.http_client, max_retries=0)
+        return self._client
+
+    def _is_retryable(self, error: Exception) -> bool:
+        from openai import APIConnectionError, APIStatusError
+        if isinstance(error, APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return isinstance(error, APIConnectionError)  # включая APITimeoutError
+
+    def _observe(self, model: str, response, elapsed: float) -> None:
+        LLM_SECONDS.observe(elapsed, model=model, outcome="ok")
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        # Responses API отдаёт input/output_tokens, Chat Completions — prompt/completion_tokens
+        input_tokens = getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", 0) or 0
+        output_tokens = getattr(usage, "output_tokens", None) or getattr(usage, "completion_tokens", 0) or 0
+        LLM_TOKENS.inc(input_tokens, model=model, kind="input")
+        LLM_TOKENS.inc(output_tokens, model=model, kind="output")
+
+    async def _request(self, create, **kwargs):
+        """
+        Вызов OpenAI под ограничителем конкурентности с повторами на 429/5xx.
+        Экспоненциальная задержка с джиттером, повторы расходуют общий бюджет.
+        """
+        try:
+            async with self.limiter.slot():
+                self.retry_budget.deposit()
+                attempt = 0
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        response = await create(**kwargs)
+                    except Exception as e:
+                        LLM_SECONDS.observe(time.perf_counter() - started, model=kwargs.get("model"), outcome="error")
+                        if (not self._is_retryable(e) or attempt >= self.max_retries
+                                or not self.retry_budget.withdraw()):
+                            raise
+                        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+                        attempt += 1
+                        await asyncio.sleep(random.uniform(delay / 2, delay))
+                        continue
+                    self._observe(kwargs.get("model"), response, time.perf_counter() - started)
+                    return response
+        except LimitExceeded:
+            raise HTTPException(status_code=503, detail="Сервис анализа перегружен, попробуйте позже")
+
+    def _batch_line(self, custom_id: str, data: dict) -> str:
+        return json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/responses",
+            "body": {
+                "model": self.text_model,
+                "instructions": self.instructions,
+                "input": json.dumps(data, ensure_ascii=False, indent=2),
+            },
+        }, ensure_ascii=False)
+
+    def _batch_output_text(self, body: dict) -> str:
+        # В файле результатов — сырой JSON ответа, без output_text из SDK
+        parts = []
+        for item in body.get("output") or []:
+            if item.get("type") != "message":
+                continue
+            for content in item.get("content") or []:
+                if content.get("type") == "output_text":
+                    parts.append(content.get("text", ""))
+        return "".join(parts).strip()
+
+    async def _submit_batch(self, items: Dict[str, dict]) -> str:
+        # JSONL с запросами, загрузка файла и создание пакета; возвращает id пакета
+        payload = "\n".join(self._batch_line(custom_id, data) for custom_id, data in items.items())
+        upload = await self.client.files.create(
+            file=("analysis.jsonl", payload.encode("utf-8"), "application/jsonl"),
+            purpose="batch",
+        )
+        batch = await self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint="/v1/responses",
+            completion_window=self.batch_completion_window,
+        )
+        return batch.id
+
+    async def _collect_batch(self, batch_id: str) -> Dict[str, dict]:
+        """
+        Опрос пакета до завершения. Возвращает разобранные ответы по custom_id;
+        упавшие строки в результат не попадают.
+        """
+        batch = await self.client.batches.retrieve(batch_id)
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            await asyncio.sleep(self.batch_poll_interval)
+            try:
+                batch = await self.client.batches.retrieve(batch_id)
+            except Exception as e:
+                # Сбой опроса — не повод бросать уже оплаченный пакет
+                if not self._is_retryable(e):
+                    raise
+                print(f"Ошибка опроса пакета анализа {batch_id}: {e}")
+        if not batch.output_file_id:
+            print(f"Пакет анализа {batch.id} завершился без результатов: {batch.status}")
+            return {}
+
+        content = await self.client.files.content(batch.output_file_id)
+        results: Dict[str, dict] = {}
+        input_tokens = output_tokens = 0
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                continue
+            body = response.get("body") or {}
+            usage = body.get("usage") or {}
+            input_tokens += usage.get("input_tokens", 0)
+            output_tokens += usage.get("output_tokens", 0)
+            output = self._batch_output_text(body)
+            try:
+                results[record["custom_id"]] = json.loads(output)
+            except json.JSONDecodeError:
+                results[record["custom_id"]] = {"analysis": output}
+        LLM_TOKENS.inc(input_tokens, model=f"{self.text_model}/batch", kind="input")
+        LLM_TOKENS.inc(output_tokens, model=f"{self.text_model}/batch", kind="output")
+        return results
+
+    async def analyze_batch(
+        self,
+        items: Dict[str, dict],
+        submitted: Sequence[str] = (),
+        on_submit: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> Dict[str, dict]:
+        """
+        Анализ многих товаров через Batch API: ключ — штрихкод, значение — данные как для analyze_data.
+        Ответы из кэша анализа в пакет не попадают; не обработанные пакетом строки
+        отправляются следующим пакетом, до batch_max_attempts раз. Все части попытки
+        отправляются сразу и собираются параллельно. Чего нет в результате —
+        анализ не удался, вызывающий решает сам (например, обычный analyze_data).
+        submitted — пакеты, отправленные до рестарта: их результаты забираются первыми.
+        on_submit вызывается с id каждого нового пакета, чтобы вызывающий мог его сохранить.
+        """
+        results: Dict[str, dict] = {}
+        keys: Dict[str, str] = {}
+        pending: Dict[str, dict] = {}
+        for barcode, data in items.items():
+            keys[barcode] = analysis_cache.key(self.text_model, self.instructions_version, data)
+            cached = await analysis_cache.get(keys[barcode])
+            if cached is not None:
+                results[barcode] = cached
+            else:
+                pending[barcode] = data
 
+        async def collect(batch_id: str) -> None:
+            for barcode, result in (await self._collect_batch(batch_id)).items():
+                if barcode not in pending:
+                    continue
+                results[barcode] = result
+                del pending[barcode]
+                if "analysis" not in result:
+                    await analysis_cache.set(keys[barcode], result)
+
+        async def collect_all(batch_ids: Sequence[str]) -> None:
+            # Пакеты обрабатываются параллельно — опрашиваем все сразу, а не по очереди
+            outcomes = await asyncio.gather(*(collect(batch_id) for batch_id in batch_ids), return_exceptions=True)
+            for batch_id, outcome in zip(batch_ids, outcomes):
+                if isinstance(outcome, HTTPException):
+                    raise outcome
+                if isinstance(outcome, BaseException):
+                    print(f"Ошибка получения пакета анализа {batch_id}: {outcome}")
+
+        await collect_all(list(submitted))
+
+        for attempt in range(self.batch_max_attempts):
+            if not pending:
+                break
+            if attempt:
+                await asyncio.sleep(self.batch_poll_interval)
+            barcodes = list(pending)
+            batch_ids: List[str] = []
+            for start in range(0, len(barcodes), self.batch_size):
+                chunk = {barcode: pending[barcode] for barcode in barcodes[start:start + self.batch_size]}
+                try:
+                    batch_id = await self._submit_batch(chunk)
+                except HTTPException:
+                    raise
+                except Exception as e:
+                    print(f"Ошибка пакетного анализа (попытка {attempt + 1}): {e}")
+                    continue
+                batch_ids.append(batch_id)
+                if on_submit is not None:
+                    await on_submit(batch_id)
+            await collect_all(batch_ids)
+        if pending:
+            print(f"Пакетный анализ не обработал {len(pending)} товаров")
+        return results
+
+    async def shutdown(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    @timed("llm_text")
     async def analyze_data(self,data: dict) -> dict:
+        cache_key = analysis_cache.key(self.text_model, self.instructions_version, data)
+        cached = await analysis_cache.get(cache_key)
+        if cached is not None:
+            return cached
         input_text = json.dumps(data, ensure_ascii=False, indent=2)
         try:
-            response = await asyncio.to_thread(
+            response = await self._request(
                 self.client.responses.create,
-                model="gpt-4.1-nano",
+                model=self.text_model,
                 instructions=self.instructions,
                 input=input_text,
             )
@@ -76,13 +324,17 @@ class Analyzer:
             try:
                 result = json.loads(output)
             except json.JSONDecodeError:
-                result = {"analysis": output}
+                return {"analysis": output}
+            await analysis_cache.set(cache_key, result)
             return result
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error analyzing text: {str(e)}")
             return {"analysis": "Unable to analyze text"}
 
-    async def analyze_image(self,barcode: str, image_base64_list: List[str]) -> dict:
+    @timed("llm_vision")
+    async def analyze_image(self,barcode: str, image_base64_list: List[str], mime_type: str = "image/jpeg") -> dict:
         messages = [
             {
                 "role": "system",
@@ -94,12 +346,12 @@ class Analyzer:
                     {"type": "text",
                     "text": f"Отсканируй и проанализируй упаковку продукта с баркодом {barcode}. Приложены изображения. " + self.instructions}
                 ] + [
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img}"}} for img in image_base64_list
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{img}"}} for img in image_base64_list
                 ],
             }
         ]
         try:
-            response = await asyncio.to_thread(
+            response = await self._request(
                 self.client.chat.completions.create,
                 model="gpt-4.1",
                 messages=messages,
@@ -113,6 +365,8 @@ class Analyzer:
             result["barcode"] = barcode
             return result
 
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error analyzing images: {str(e)}")
             return {"analysis": "Unable to analyze images", "barcode": barcode}
@@ -0,0 +1,129 @@
+from html.parser import HTMLParser
+from typing import List, Optional
+
+RESULTS_TABLE_CLASS = "randomBarcodes"
+
+
+class _TableProbe:
+    """
+    Следит за одной таблицей: ищет третью ячейку <td> во второй строке <tr>
+    (первая строка — заголовок). result: None — ещё не ясно, True/False — ответ.
+    """
+    def __init__(self):
+        self.depth = 0
+        self.rows = 0
+        self.cells = 0
+        self.capturing = False
+        self.text: List[str] = []
+        self.result: Optional[bool] = None
+
+    def _finish_cell(self) -> None:
+        self.capturing = False
+        self.result = bool("".join(self.text).strip())
+
+    def start(self, tag: str) -> None:
+        if self.result is not None:
+            return
+        if tag in ("td", "tr") and self.capturing:
+            self._finish_cell()
+            return
+        if tag == "table":
+            self.depth += 1
+        elif tag == "tr":
+            self.rows += 1
+            if self.rows > 2:
+                # Вторая строка закончилась, а третьей ячейки в ней не было
+                self.result = False
+        elif tag == "td" and self.rows == 2:
+            self.cells += 1
+            if self.cells == 3:
+                self.capturing = True
+
+    def end(self, tag: str) -> bool:
+        """True, если закрылась сама отслеживаемая таблица."""
+        if tag in ("td", "tr", "table") and self.capturing:
+            self._finish_cell()
+        if tag != "table":
+            return False
+        if self.depth == 0:
+            self.finish()
+            return True
+        self.depth -= 1
+        return False
+
+    def finish(self) -> None:
+        if self.capturing:
+            self._finish_cell()
+        elif self.result is None:
+            self.result = False
+
+    def data(self, text: str) -> None:
+        if self.capturing:
+            self.text.append(text)
+
+
+class BarcodeTableExtractor(HTMLParser):
+    """
+    Потоковый разбор страницы поиска barcode-list: есть ли название товара
+    в первой строке данных таблицы результатов. Смотрит на таблицу
+    class="randomBarcodes", а если её нет — на первую таблицу страницы.
+    Страница подаётся кусками через feed(); как только ответ по таблице
+    результатов известен, done становится True и дальше читать не нужно.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.results: Optional[_TableProbe] = None
+        self.first: Optional[_TableProbe] = None
+        self._open: List[_TableProbe] = []
+
+    @property
+    def done(self) -> bool:
+        return self.results is not None and self.results.result is not None
+
+    @property
+    def found(self) -> bool:
+        if self.results is not None:
+            return bool(self.results.result)
+        # Таблицы результатов на странице не оказалось — как и раньше, смотрим первую
+        return bool(self.first is not None and self.first.result)
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        for probe in self._open:
+            probe.start(tag)
+        if tag != "table":
+            return
+        classes = (dict(attrs).get("class") or "").split()
+        probe = None
+        if self.results is None and RESULTS_TABLE_CLASS in classes:
+            probe = self.results = _TableProbe()
+        if self.first is None:
+            probe = self.first = probe or _TableProbe()
+        if probe is not None:
+            self._open.append(probe)
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        for probe in list(self._open):
+            if probe.end(tag):
+                self._open.remove(probe)
+
+    def handle_data(self, data):
+        for probe in self._open:
+            probe.data(data)
+
+    def close(self) -> None:
+        super().close()
+        # Страница оборвалась внутри таблицы — решаем по тому, что успели прочитать
+        for probe in self._open:
+            probe.finish()
+        self._open.clear()
+
+
+def product_name_present(html: str) -> bool:
+    extractor = BarcodeTableExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.found
@@ -0,0 +1,216 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from models import Product
+from services.store import CacheStore, build_store
+from services.metrics import timed
+
+
+class TTLCache:
+    """
+    Ограниченный LRU-кэш с временем жизни записей и счётчиками попаданий.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class EncodedProduct:
+    """
+    Product вместе с готовым JSON-телом ответа и сильным ETag по его содержимому.
+    """
+    __slots__ = ("product", "body", "etag")
+
+    def __init__(self, product: Product, body: Optional[bytes] = None):
+        self.product = product
+        self.body = body if body is not None else product.model_dump_json().encode("utf-8")
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+    @classmethod
+    def from_body(cls, body: bytes) -> "EncodedProduct":
+        return cls(Product.model_validate_json(body), body)
+
+
+class ProductCache:
+    """
+    Кэш горячих штрихкодов перед Database.find_data.
+    Первый уровень — в памяти процесса: Product с готовым JSON и ETag,
+    а отдельно — недавние «не найдено нигде». Второй уровень (CacheStore)
+    общий для всех воркеров; инвалидации через него доходят до остальных процессов.
+    """
+    def __init__(self):
+        self.found = TTLCache(
+            maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("PRODUCT_CACHE_TTL", "300")),
+        )
+        self.missing = TTLCache(
+            maxsize=int(os.getenv("PRODUCT_NEGATIVE_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("PRODUCT_NEGATIVE_CACHE_TTL", "600")),
+        )
+        self.shared_ttl = float(os.getenv("PRODUCT_SHARED_CACHE_TTL", "3600"))
+        self.sync_interval = float(os.getenv("CACHE_SYNC_INTERVAL", "1"))
+        self.shared: Optional[CacheStore] = None
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.stale_fills = 0
+        # Инвалидации своего процесса: номер и недавно инвалидированные штрихкоды — чтобы не
+        # положить в кэш строку, прочитанную из БД до изменения (см. fill_token/store)
+        self._sequence = 0
+        self._invalidated = TTLCache(maxsize=10000, ttl=300)
+        self._sync_task: Optional[asyncio.Task] = None
+
+    async def startup(self) -> None:
+        if self.shared is None:
+            self.shared = await asyncio.to_thread(build_store)
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def shutdown(self) -> None:
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+    async def _sync_loop(self) -> None:
+        # Применяем инвалидации, сделанные другими воркерами, и чистим просроченное
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                for key in await asyncio.to_thread(self.shared.poll_invalidations):
+                    barcode = key.split(":", 1)[-1]
+                    self.found.delete(barcode)
+                    self.missing.delete(barcode)
+                if time.monotonic() - last_cleanup > 60:
+                    await asyncio.to_thread(self.shared.cleanup)
+                    last_cleanup = time.monotonic()
+            except Exception as e:
+                print(f"Ошибка синхронизации общего кэша: {e}")
+
+    def get_entry(self, barcode: str) -> Optional[EncodedProduct]:
+        return self.found.get(barcode)
+
+    def get(self, barcode: str) -> Optional[Product]:
+        entry = self.get_entry(barcode)
+        return entry.product if entry is not None else None
+
+    @timed("shared_cache")
+    async def get_shared(self, barcode: str) -> Optional[EncodedProduct]:
+        if self.shared is None:
+            return None
+        body = await asyncio.to_thread(self.shared.get, f"product:{barcode}")
+        if body is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        entry = EncodedProduct.from_body(body)
+        self.found.set(barcode, entry)
+        return entry
+
+    async def fill_token(self) -> Tuple[int, int]:
+        """
+        Берётся до чтения товара из БД и передаётся в store: если товар успели изменить
+        (инвалидировать) за время чтения, прочитанная копия в кэш не попадёт.
+        """
+        version = await asyncio.to_thread(self.shared.version) if self.shared is not None else 0
+        return self._sequence, version
+
+    async def store(self, product: Product, token: Tuple[int, int]) -> EncodedProduct:
+        entry = EncodedProduct(product)
+        sequence, version = token
+        if self._invalidated.get(product.barcode, 0) > sequence:
+            self.stale_fills += 1
+            return entry
+        if self.shared is not None and not await asyncio.to_thread(
+            self.shared.set_if_unchanged, f"product:{product.barcode}", entry.body, self.shared_ttl, version
+        ):
+            self.stale_fills += 1
+            return entry
+        self.missing.delete(product.barcode)
+        self.found.set(product.barcode, entry)
+        return entry
+
+    def is_missing(self, barcode: str) -> bool:
+        return self.missing.get(barcode) is not None
+
+    def mark_missing(self, barcode: str) -> None:
+        self.missing.set(barcode, True)
+
+    async def invalidate(self, barcode: str) -> None:
+        self._sequence += 1
+        self._invalidated.set(barcode, self._sequence)
+        self.found.delete(barcode)
+        self.missing.delete(barcode)
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.invalidate, f"product:{barcode}")
+
+    def stats(self) -> dict:
+        total = self.shared_hits + self.shared_misses
+        return {
+            "found": self.found.stats(),
+            "missing": self.missing.stats(),
+            "shared": {
+                "store": type(self.shared).__name__ if self.shared is not None else None,
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+                "hit_ratio": round(self.shared_hits / total, 4) if total else 0.0,
+                "stale_fills": self.stale_fills,
+            },
+        }
+
+
+product_cache = ProductCache()
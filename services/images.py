@@ -0,0 +1,128 @@
+import os
+import json
+import tempfile
+from typing import Optional
+from services.parser import parser
+from services.metrics import timed
+
+IMAGES_DIR = os.getenv("IMAGES_DIR", "static/images")
+IMAGES_BASE_URL = os.getenv("IMAGES_BASE_URL", "https://iscan.store/static/images")
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """
+    Определяет формат изображения по сигнатуре первых байт (нужно минимум 12).
+    """
+    if head[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def public_url(filename: str) -> str:
+    return f"{IMAGES_BASE_URL}/{filename}"
+
+
+class ImageFetcher:
+    """
+    Потоковое скачивание картинок с внешних источников в IMAGES_DIR.
+    Тело пишется кусками во временный файл с ограничением размера и
+    атомарно переносится на место; повторная загрузка пропускается,
+    если источник отвечает тем же ETag/Last-Modified.
+    """
+    def __init__(self):
+        self.max_bytes = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+        self.chunk_size = int(os.getenv("IMAGE_CHUNK_SIZE", str(64 * 1024)))
+        self.timeout = float(os.getenv("IMAGE_TIMEOUT", "10"))
+
+    def _read_meta(self, meta_path: str) -> Optional[dict]:
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta_path: str, url: str, headers) -> None:
+        meta = {
+            "url": url,
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+        }
+        try:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        except OSError as e:
+            print(f"Не удалось сохранить метаданные {meta_path}: {e}")
+
+    def _same_version(self, meta: dict, headers) -> bool:
+        etag = headers.get("etag")
+        if etag and meta.get("etag"):
+            return etag == meta["etag"]
+        last_modified = headers.get("last-modified")
+        return bool(last_modified and last_modified == meta.get("last_modified"))
+
+    @timed("image_download")
+    async def fetch(self, url: str, barcode: str, suffix: str = "roskachestvo") -> Optional[str]:
+        filename = f"{barcode}_{suffix}.jpg"
+        filepath = os.path.join(IMAGES_DIR, filename)
+        meta_path = f"{filepath}.meta"
+        meta = self._read_meta(meta_path) if os.path.exists(filepath) else None
+        if meta and meta.get("url") != url:
+            meta = None
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        tmp_path = None
+        try:
+            async with parser.host_slot(url):
+                async with parser.http.stream("GET", url, headers=headers, timeout=self.timeout) as response:
+                    if meta and (response.status_code == 304 or
+                                 (response.status_code == 200 and self._same_version(meta, response.headers))):
+                        return public_url(filename)
+                    if response.status_code != 200:
+                        print(f"Не удалось скачать изображение: {url}, статус {response.status_code}")
+                        return None
+                    declared = response.headers.get("content-length")
+                    if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                        print(f"Изображение {url} слишком большое: {declared} байт")
+                        return None
+
+                    os.makedirs(IMAGES_DIR, exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=IMAGES_DIR, prefix=f".{filename}.", suffix=".part")
+                    size = 0
+                    head = b""
+                    with os.fdopen(fd, "wb") as f:
+                        async for chunk in response.aiter_bytes(self.chunk_size):
+                            if len(head) < 12:
+                                head += chunk[:12 - len(head)]
+                                if len(head) >= 12 and sniff_image_format(head) is None:
+                                    print(f"Файл по ссылке {url} не является изображением (jpeg/png/webp)")
+                                    return None
+                            size += len(chunk)
+                            if size > self.max_bytes:
+                                print(f"Изображение {url} больше {self.max_bytes} байт, загрузка прервана")
+                                return None
+                            f.write(chunk)
+                    if sniff_image_format(head) is None:
+                        print(f"Файл по ссылке {url} не является изображением (jpeg/png/webp)")
+                        return None
+                    os.replace(tmp_path, filepath)
+                    tmp_path = None
+                    self._write_meta(meta_path, url, response.headers)
+                    return public_url(filename)
+        except Exception as e:
+            print(f"Ошибка при скачивании изображения: {e}")
+            return None
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+image_fetcher = ImageFetcher()
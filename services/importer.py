@@ -0,0 +1,224 @@
+import os
+import uuid
+import asyncio
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from database import db
+from models import ImportJob, ImportJobDB, Product
+from services.analyzer import analyzer
+from services.images import image_fetcher
+from services.limits import TokenBucket
+from services.parser import parser
+from services import products
+
+
+class Importer:
+    """
+    Фоновый импорт товаров Роскачества по списку штрихкодов.
+    Несколько воркеров, ограничение частоты на каждый внешний хост,
+    запись в БД пачками; прогресс хранится в import_jobs, поэтому
+    после рестарта задача продолжается с необработанных штрихкодов.
+    В режиме IMPORT_ANALYSIS_MODE=batch анализ идёт не по одному товару,
+    а пакетами через Batch API после сбора данных из источников.
+    """
+    def __init__(self):
+        self.workers = int(os.getenv("IMPORT_WORKERS", "4"))
+        self.flush_size = int(os.getenv("IMPORT_FLUSH_SIZE", "50"))
+        self.rate_per_host = float(os.getenv("IMPORT_RATE_PER_HOST", "1"))
+        self.burst_per_host = float(os.getenv("IMPORT_BURST_PER_HOST", "2"))
+        # Воркер, ведущий задачу, периодически отмечается; задачу без отметок может забрать другой
+        self.heartbeat_interval = float(os.getenv("IMPORT_HEARTBEAT_INTERVAL", "15"))
+        self.stale_after = float(os.getenv("IMPORT_STALE_AFTER", "60"))
+        # realtime — analyze_data на каждый товар, batch — analyzer.analyze_batch
+        self.analysis_mode = os.getenv("IMPORT_ANALYSIS_MODE", "realtime").lower()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).hostname or ""
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rate_per_host, self.burst_per_host)
+        return bucket
+
+    async def create_job(self, barcodes: List[str]) -> str:
+        job_id = uuid.uuid4().hex
+        await db.create_import_job(job_id, list(dict.fromkeys(barcodes)))
+        self._start(job_id)
+        return job_id
+
+    async def resume_jobs(self) -> None:
+        for job in await db.get_unfinished_import_jobs():
+            if await db.claim_import_job(job.id, self.stale_after):
+                self._start(job.id)
+
+    def _start(self, job_id: str) -> None:
+        if job_id not in self._tasks:
+            task = asyncio.create_task(self._run(job_id))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def shutdown(self) -> None:
+        # Незавершённые задачи возвращаются в очередь и продолжатся при следующем старте
+        job_ids = list(self._tasks)
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        for job_id in job_ids:
+            job = await db.get_import_job(job_id)
+            if job is not None and job.status == "running":
+                await db.update_import_job(job_id, "queued", job.results or {})
+
+    async def _fetch(self, barcode: str) -> Optional[tuple[dict, Optional[str]]]:
+        url = parser.roskachestvo_search_url(barcode)
+        await self._bucket(url).acquire()
+        roskachestvo_data = await parser.fetch_from_roskachestvo(barcode)
+        if not roskachestvo_data or not roskachestvo_data.get("product", {}).get("title"):
+            return None
+        image_url = roskachestvo_data["product"].get("thumbnail")
+        local_image_url = None
+        if image_url:
+            await self._bucket(image_url).acquire()
+            local_image_url = await image_fetcher.fetch(image_url, barcode, "roskachestvo")
+        return roskachestvo_data, local_image_url
+
+    async def _process(self, barcode: str) -> tuple[str, Optional[Product]]:
+        fetched = await self._fetch(barcode)
+        if fetched is None:
+            return "not_found", None
+        roskachestvo_data, local_image_url = fetched
+        analysis = await analyzer.analyze_data(roskachestvo_data["product"])
+        return "ok", products.from_roskachestvo(barcode, roskachestvo_data, analysis, local_image_url)
+
+    async def _run(self, job_id: str) -> None:
+        job = await db.get_import_job(job_id)
+        if job is None:
+            return
+        results: dict = dict(job.results or {})
+        # batch: найденные товары ждут пакетного анализа после обхода источников. Собранное
+        # и id отправленных пакетов хранятся в задаче — после рестарта их не собираем заново
+        saved = job.analysis or {}
+        fetched: Dict[str, tuple[dict, Optional[str]]] = {
+            barcode: (item["data"], item["image"])
+            for barcode, item in (saved.get("items") or {}).items()
+            if barcode not in results
+        }
+        submitted: List[str] = list(saved.get("batches") or [])
+        queue: asyncio.Queue = asyncio.Queue()
+        for barcode in job.barcodes:
+            if barcode not in results and barcode not in fetched:
+                queue.put_nowait(barcode)
+        pending: Dict[str, str] = {}
+        buffer: List[Product] = []
+        flush_lock = asyncio.Lock()
+
+        async def flush() -> None:
+            async with flush_lock:
+                if not pending:
+                    return
+                batch, statuses = list(buffer), dict(pending)
+                buffer.clear()
+                pending.clear()
+                await db.upsert_many(batch)
+                results.update(statuses)
+                await db.update_import_job(job_id, "running", results)
+
+        async def worker() -> None:
+            while True:
+                try:
+                    barcode = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    if self.analysis_mode == "batch":
+                        found = await self._fetch(barcode)
+                        if found is not None:
+                            fetched[barcode] = found
+                            continue
+                        pending[barcode] = "not_found"
+                    else:
+                        status, product = await self._process(barcode)
+                        if product is not None:
+                            buffer.append(product)
+                        pending[barcode] = status
+                except Exception as e:
+                    pending[barcode] = f"error: {e}"
+                if len(pending) >= self.flush_size:
+                    await flush()
+
+        async def save_analysis() -> None:
+            await db.update_import_job_analysis(job_id, {
+                "items": {barcode: {"data": data, "image": image} for barcode, (data, image) in fetched.items()},
+                "batches": submitted,
+            })
+
+        async def on_submit(batch_id: str) -> None:
+            submitted.append(batch_id)
+            await save_analysis()
+
+        async def analyze_fetched() -> None:
+            await save_analysis()
+            analyses = await analyzer.analyze_batch(
+                {barcode: data["product"] for barcode, (data, _) in fetched.items()},
+                submitted=list(submitted),
+                on_submit=on_submit,
+            )
+            for barcode, (data, local_image_url) in fetched.items():
+                try:
+                    analysis = analyses.get(barcode)
+                    if analysis is None:
+                        # Пакет так и не обработал товар — анализируем обычным запросом
+                        analysis = await analyzer.analyze_data(data["product"])
+                    buffer.append(products.from_roskachestvo(barcode, data, analysis, local_image_url))
+                    pending[barcode] = "ok"
+                except Exception as e:
+                    pending[barcode] = f"error: {e}"
+                if len(pending) >= self.flush_size:
+                    await flush()
+            await flush()
+            await db.update_import_job_analysis(job_id, None)
+
+        async def heartbeat() -> None:
+            while True:
+                await asyncio.sleep(self.heartbeat_interval)
+                try:
+                    await db.touch_import_job(job_id)
+                except Exception as e:
+                    print(f"Ошибка отметки задачи импорта {job_id}: {e}")
+
+        beat = asyncio.create_task(heartbeat())
+        try:
+            await db.update_import_job(job_id, "running", results)
+            await asyncio.gather(*(worker() for _ in range(self.workers)))
+            await flush()
+            if fetched:
+                await analyze_fetched()
+            await db.update_import_job(job_id, "done", results)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ошибка импорта {job_id}: {e}")
+            await db.update_import_job(job_id, "failed", results)
+        finally:
+            beat.cancel()
+
+    def describe(self, job: ImportJobDB, with_results: bool = False) -> ImportJob:
+        results = job.results or {}
+        statuses = list(results.values())
+        ok = statuses.count("ok")
+        not_found = statuses.count("not_found")
+        return ImportJob(
+            id=job.id,
+            status=job.status,
+            total=len(job.barcodes),
+            processed=len(results),
+            ok=ok,
+            not_found=not_found,
+            errors=len(statuses) - ok - not_found,
+            created_at=job.created_at,
+            updated_at=job.updated_at,
+            results=results if with_results else None,
+        )
+
+
+importer = Importer()
@@ -0,0 +1,187 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+
+class LimitExceeded(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """
+    Семафор с ограниченной очередью ожидания: лишние запросы
+    сразу получают LimitExceeded вместо того, чтобы копиться.
+    """
+    def __init__(self, limit: int, max_waiting: int, max_wait: float):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise LimitExceeded("очередь переполнена")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise LimitExceeded("превышено время ожидания слота")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+class RetryBudget:
+    """
+    Глобальный бюджет повторов: каждый запрос пополняет его на ratio,
+    каждый повтор тратит единицу. Не даёт ретраям умножать нагрузку при сбоях.
+    """
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.spent = 0
+        self.denied = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.spent += 1
+            return True
+        self.denied += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "tokens": round(self.tokens, 2),
+            "spent": self.spent,
+            "denied": self.denied,
+        }
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: rate токенов в секунду, запас до burst.
+    acquire() ждёт, пока не появится токен.
+    """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    Автомат для одного апстрима: после failure_threshold ошибок подряд размыкается
+    на cooldown секунд, и запросы сразу получают CircuitOpenError, не дожидаясь таймаута.
+    После паузы пропускает один пробный запрос: успех замыкает цепь, ошибка — снова размыкает.
+    """
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probing = False
+
+    def check(self) -> None:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "closed":
+            return
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name} отключён после {self.failures} ошибок подряд")
+
+    def success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.trips += 1
+
+    def release(self) -> None:
+        # Запрос отменён без ответа — ни успех, ни ошибка; освобождаем место пробного
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.STATES[self.state],
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyWindow:
+    """
+    Скользящее окно последних size длительностей для оценки квантилей.
+    """
+    def __init__(self, size: int, min_samples: int):
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -1,14 +1,98 @@
 import io
-from PIL import Image
+import os
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Optional, Union
+from services.metrics import timed
+
+
+def transcode_image(
+    source: Union[bytes, str],
+    max_edge: int,
+    output_format: str,
+    quality: int,
+    progressive: bool,
+    max_pixels: int,
+) -> bytes:
+    # Функция уровня модуля, чтобы её можно было отдать в ProcessPoolExecutor.
+    # Pillow импортируется при первом перекодировании, а не при старте воркера
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        # Для JPEG декодер сразу уменьшает картинку кратно 1/2..1/8 — дешевле полного декода
+        img.draft("RGB", (max_edge, max_edge))
+        if max(img.size) > max_edge:
+            factor = max(img.size) // max_edge
+            if factor >= 2:
+                img = img.reduce(factor)
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        rgb_img = img.convert('RGB')  # На случай, если исходник был с альфа-каналом (например, PNG)
+        buffer = io.BytesIO()
+        if output_format == "webp":
+            rgb_img.save(buffer, format="WEBP", quality=quality, method=4)
+        else:
+            rgb_img.save(buffer, format="JPEG", quality=quality, progressive=progressive, optimize=progressive)
+        return buffer.getvalue()
 
 
 class Media:
-    def convert_to_jpeg(self, image_bytes: bytes) -> bytes:
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            buffer = io.BytesIO()
-            rgb_img = img.convert('RGB')  # На случай, если исходник был с альфа-каналом (например, PNG)
-            # image compression
-            rgb_img.save(buffer, format="JPEG", quality=95)
-            return buffer.getvalue()
-
-media = Media()
\ No newline at end of file
+    def __init__(self):
+        # thread — потоки (Pillow отпускает GIL при кодировании), process — отдельные процессы
+        self.executor_kind = os.getenv("MEDIA_EXECUTOR", "thread").lower()
+        self.workers = int(os.getenv("MEDIA_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.max_edge = int(os.getenv("MEDIA_MAX_EDGE", "2048"))
+        self.quality = int(os.getenv("MEDIA_QUALITY", "95"))
+        self.progressive = os.getenv("MEDIA_PROGRESSIVE", "false").lower() == "true"
+        self.output_format = os.getenv("MEDIA_FORMAT", "jpeg").lower()
+        # Защита от «картинок-бомб»: ограничивает память на один декод
+        self.max_pixels = int(os.getenv("MEDIA_MAX_PIXELS", str(50_000_000)))
+        self._executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(self.workers)
+
+    @property
+    def extension(self) -> str:
+        return "webp" if self.output_format == "webp" else "jpg"
+
+    @property
+    def mime_type(self) -> str:
+        return "image/webp" if self.output_format == "webp" else "image/jpeg"
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="media")
+        return self._executor
+
+    def _job(self, source: Union[bytes, str]):
+        return partial(
+            transcode_image,
+            source,
+            self.max_edge,
+            self.output_format,
+            self.quality,
+            self.progressive,
+            self.max_pixels,
+        )
+
+    @timed("transcode")
+    async def transcode(self, source: Union[bytes, str]) -> bytes:
+        """
+        Уменьшает и перекодирует изображение вне event loop.
+        Одновременно выполняется не больше MEDIA_WORKERS задач.
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self._job(source))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+media = Media()
@@ -0,0 +1,234 @@
+import time
+import asyncio
+import functools
+import inspect
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            # [счётчики по корзинам..., сумма, количество]
+            series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, series in self.series.items():
+            labels = _format_labels(self.labelnames, key)
+            for i, bound in enumerate(self.buckets):
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {series[i]}")
+            inf_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """
+    Минимальный реестр метрик в текстовом формате Prometheus.
+    Метрики живут в памяти процесса: при нескольких воркерах каждый отдаёт свои.
+    """
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, fn: Callable[[], None]) -> Callable[[], None]:
+        # Вызывается перед каждой выгрузкой — для метрик, которые читаются из состояния сервисов
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Ошибка сбора метрик: {e}")
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "aiscan_stage_duration_seconds", "Длительность этапов обработки запроса", ("stage",)
+)
+UPSTREAM_SECONDS = registry.histogram(
+    "aiscan_upstream_duration_seconds", "Длительность запросов к внешним источникам", ("upstream", "outcome")
+)
+SOURCE_RESULTS = registry.counter(
+    "aiscan_source_results_total", "Результаты опроса источников штрихкодов", ("source", "result")
+)
+LLM_SECONDS = registry.histogram(
+    "aiscan_llm_duration_seconds", "Длительность вызовов LLM", ("model", "outcome")
+)
+LLM_TOKENS = registry.counter(
+    "aiscan_llm_tokens_total", "Токены LLM", ("model", "kind")
+)
+HTTP_SECONDS = registry.histogram(
+    "aiscan_http_request_duration_seconds", "Длительность HTTP-запросов к API", ("method", "route", "status")
+)
+LOOP_LAG_SECONDS = registry.histogram(
+    "aiscan_event_loop_lag_seconds", "Задержка event loop относительно расписания",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+# Этапы текущего запроса для заголовка Server-Timing
+request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def record_stage(stage: str, elapsed: float) -> None:
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((stage, elapsed))
+
+
+def timed(stage: str):
+    """
+    Декоратор: пишет длительность вызова в гистограмму этапов и в Server-Timing запроса.
+    """
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    record_stage(stage, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: float) -> str:
+    totals: Dict[str, float] = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in totals.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+async def server_timing(request, call_next):
+    timings: List[Tuple[str, float]] = []
+    token = request_timings.set(timings)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        request_timings.reset(token)
+        total = time.perf_counter() - started
+        route = request.scope.get("route")
+        HTTP_SECONDS.observe(
+            total,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
+    response.headers["Server-Timing"] = server_timing_header(timings, total)
+    return response
+
+
+async def monitor_event_loop(interval: float = 0.5) -> None:
+    # Насколько позже запланированного просыпается корутина — признак блокировки loop
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - started - interval))
@@ -0,0 +1,268 @@
+"""
+Локальное зеркало OpenFoodFacts на SQLite.
+
+Импорт потоково читает дамп OFF (JSONL или CSV/TSV, можно .gz) и сохраняет
+по каждому штрихкоду только поля, которые использует Parser.extract_product_details.
+Память постоянна: строки пишутся пачками, дамп целиком не загружается. Дельты
+применяются тем же импортом — запись заменяется, только если она новее (last_modified_t).
+
+    python -m services.off_mirror import openfoodfacts-products.jsonl.gz
+    python -m services.off_mirror import en.openfoodfacts.org.products.csv.gz
+    python -m services.off_mirror import delta/*.json.gz
+    python -m services.off_mirror get 4600000000000
+"""
+import os
+import csv
+import sys
+import gzip
+import json
+import time
+import zlib
+import asyncio
+import sqlite3
+import argparse
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple
+from services.metrics import timed
+
+# Поля, которые читает Parser.extract_product_details — остальное в дампе не нужно
+OFF_FIELDS = (
+    "product_name", "generic_name", "ingredients_text", "brands", "categories", "categories_old",
+    "allergens", "allergens_from_ingredients", "allergens_from_user", "origins",
+    "additives_original_tags", "additives_tags", "compared_to_category", "countries",
+    "created_t", "data_sources", "image_front_url", "image_ingredients_url", "ingredients",
+    "labels", "known_ingredients_n", "nutriments", "serving_quantity", "serving_quantity_unit",
+    "serving_size",
+)
+# Поля CSV-выгрузки, которые в JSON — списки
+CSV_LIST_FIELDS = ("additives_tags", "additives_original_tags")
+BATCH_SIZE = 5000
+
+
+def barcode_variants(barcode: str) -> Tuple[str, ...]:
+    # В OFF один товар бывает записан как UPC-A (12 цифр) и как EAN-13 с ведущим нулём
+    if len(barcode) == 12:
+        return barcode, "0" + barcode
+    if len(barcode) == 13 and barcode.startswith("0"):
+        return barcode, barcode[1:]
+    return (barcode,)
+
+
+def selected_image(record: dict, kind: str) -> Optional[str]:
+    # В JSONL-дампе нет готовых image_*_url, берём выбранную картинку на любом языке
+    display = ((record.get("selected_images") or {}).get(kind) or {}).get("display") or {}
+    return next(iter(display.values()), None) if isinstance(display, dict) else None
+
+
+def compact_json(record: dict) -> Dict[str, Any]:
+    details = {field: record[field] for field in OFF_FIELDS if record.get(field) not in (None, "", [], {})}
+    if "image_front_url" not in details:
+        url = record.get("image_url") or selected_image(record, "front")
+        if url:
+            details["image_front_url"] = url
+    if "image_ingredients_url" not in details:
+        url = selected_image(record, "ingredients")
+        if url:
+            details["image_ingredients_url"] = url
+    return details
+
+
+def compact_csv(row: dict) -> Dict[str, Any]:
+    record = dict(row)
+    for field in CSV_LIST_FIELDS:
+        if record.get(field):
+            record[field] = record[field].split(",")
+    # В CSV пищевая ценность разложена по колонкам *_100g / *_serving
+    nutriments = {
+        key: value for key, value in row.items()
+        if value and (key.endswith("_100g") or key.endswith("_serving"))
+    }
+    if nutriments:
+        record["nutriments"] = nutriments
+    return compact_json(record)
+
+
+def open_dump(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, "r", encoding="utf-8", errors="replace", newline="")
+
+
+def read_dump(path: str) -> Iterator[Tuple[str, int, Dict[str, Any]]]:
+    """
+    Построчно отдаёт (штрихкод, last_modified_t, нужные поля) из дампа.
+    """
+    name = path[:-3] if path.endswith(".gz") else path
+    with open_dump(path) as f:
+        if name.endswith((".csv", ".tsv")):
+            csv.field_size_limit(sys.maxsize)
+            header = f.readline()
+            # Выгрузка OFF — TSV без кавычек; обычный CSV тоже поддерживаем
+            if "\t" in header:
+                options = {"delimiter": "\t", "quoting": csv.QUOTE_NONE}
+            else:
+                options = {"delimiter": ","}
+            fieldnames = next(csv.reader([header], **options))
+            for row in csv.DictReader(f, fieldnames=fieldnames, **options):
+                code = (row.get("code") or "").strip()
+                if code.isdigit():
+                    yield code, int(float(row.get("last_modified_t") or 0)), compact_csv(row)
+            return
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            code = str(record.get("code") or record.get("_id") or "").strip()
+            if code.isdigit():
+                yield code, int(record.get("last_modified_t") or 0), compact_json(record)
+
+
+class OffMirror:
+    """
+    Чтение и импорт зеркала. Запись — одна строка на штрихкод: сжатый JSON
+    нужных полей и время изменения в OFF для применения дельт.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("OFF_MIRROR_PATH", "cache/off_mirror.sqlite3")
+        self.hits = 0
+        self.misses = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                "code TEXT PRIMARY KEY, modified_t INTEGER NOT NULL, data BLOB NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS imports ("
+                "file TEXT NOT NULL, imported_at REAL NOT NULL, rows INTEGER NOT NULL, written INTEGER NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _get(self, barcode: str) -> Optional[dict]:
+        with self._lock:
+            conn = self._connect()
+            for code in barcode_variants(barcode):
+                row = conn.execute("SELECT data FROM products WHERE code = ?", (code,)).fetchone()
+                if row is not None:
+                    return json.loads(zlib.decompress(row[0]))
+        return None
+
+    @timed("off_mirror")
+    async def get(self, barcode: str) -> Optional[dict]:
+        if not self.available:
+            return None
+        try:
+            record = await asyncio.to_thread(self._get, barcode)
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            print(f"Ошибка чтения зеркала OpenFoodFacts: {e}")
+            record = None
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def import_file(self, path: str, batch_size: int = BATCH_SIZE) -> Tuple[int, int]:
+        """
+        Импортирует дамп или дельту. Возвращает (прочитано строк, записано строк).
+        """
+        conn = self._connect()
+        # Импорт — отдельный процесс: ради скорости жертвуем устойчивостью к сбою питания
+        conn.execute("PRAGMA synchronous=OFF")
+        rows = written = 0
+        batch = []
+
+        def flush() -> int:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT INTO products (code, modified_t, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (code) DO UPDATE SET modified_t = excluded.modified_t, data = excluded.data "
+                "WHERE excluded.modified_t >= products.modified_t",
+                batch,
+            )
+            conn.commit()
+            batch.clear()
+            return conn.total_changes - before
+
+        started = time.monotonic()
+        for code, modified_t, details in read_dump(path):
+            rows += 1
+            payload = json.dumps(details, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            batch.append((code, modified_t, zlib.compress(payload, 6)))
+            if len(batch) >= batch_size:
+                written += flush()
+                if rows % (batch_size * 20) == 0:
+                    print(f"{path}: {rows} строк, {rows / (time.monotonic() - started):.0f} строк/с")
+        if batch:
+            written += flush()
+        conn.execute(
+            "INSERT INTO imports (file, imported_at, rows, written) VALUES (?, ?, ?, ?)",
+            (os.path.basename(path), time.time(), rows, written),
+        )
+        conn.commit()
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return rows, written
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "available": self.available,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+off_mirror = OffMirror()
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(prog="python -m services.off_mirror")
+    arg_parser.add_argument("--path", help="Файл зеркала (по умолчанию OFF_MIRROR_PATH)")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    import_command = commands.add_parser("import", help="Импорт дампа или дельт OpenFoodFacts")
+    import_command.add_argument("files", nargs="+")
+    import_command.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    get_command = commands.add_parser("get", help="Показать запись по штрихкоду")
+    get_command.add_argument("barcode")
+    args = arg_parser.parse_args()
+
+    mirror = OffMirror(args.path)
+    if args.command == "get":
+        if not mirror.available:
+            raise SystemExit(f"Зеркало {mirror.path} ещё не импортировано")
+        print(json.dumps(mirror._get(args.barcode), ensure_ascii=False, indent=2))
+        return
+    # Порядок файлов не важен: более старая версия записи не затрёт новую
+    for path in args.files:
+        started = time.monotonic()
+        rows, written = mirror.import_file(path, args.batch_size)
+        print(f"{path}: прочитано {rows}, записано {written} за {time.monotonic() - started:.1f} с")
+    mirror.close()
+
+
+if __name__ == "__main__":
+    main()
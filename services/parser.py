@@ -1,22 +1,217 @@
 import os
+import asyncio
+import time
 import httpx
-import requests
-import openai
-from typing import Optional
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Set, Tuple
 import json
-from bs4 import BeautifulSoup
+from contextlib import contextmanager
+from contextvars import ContextVar
 from fastapi import HTTPException
+from services.barcode_list import BarcodeTableExtractor
+from services.cache import TTLCache
+from services.limits import CircuitBreaker, CircuitOpenError, LatencyWindow, RetryBudget
+from services.metrics import timed, SOURCE_RESULTS, UPSTREAM_SECONDS
+from services.off_mirror import off_mirror
+
+try:
+    import h2  # noqa: F401  — HTTP/2 включается, только если установлен пакет h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Хосты, запросы к которым идут внутри текущего бюджета источника (см. _with_deadline)
+in_flight_hosts: ContextVar[Optional[Set[str]]] = ContextVar("in_flight_hosts", default=None)
 
 
 class Parser:
     def __init__(self):
-        # ChatGPT
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            print("Предупреждение: OPENAI_API_KEY не найден в переменных окружения")
-        openai.api_key = self.api_key
+        # parallel — все источники стартуют сразу, sequential — по очереди, как раньше
+        self.lookup_mode = os.getenv("LOOKUP_MODE", "parallel").lower()
+        self.deadlines = {
+            "roskachestvo": float(os.getenv("ROSKACHESTVO_DEADLINE", "5")),
+            "openfoodfacts": float(os.getenv("OPENFOODFACTS_DEADLINE", "5")),
+            "barcode_list": float(os.getenv("BARCODE_LIST_DEADLINE", "10")),
+        }
+        # Адреса источников переопределяются для бенчмарков и стендов (см. benchmarks/fakes.py)
+        self.roskachestvo_url = os.getenv("ROSKACHESTVO_BASE_URL", "https://rskrf.ru").rstrip("/")
+        self.openfoodfacts_url = os.getenv("OPENFOODFACTS_BASE_URL", "https://world.openfoodfacts.org").rstrip("/")
+        self.barcode_list_ru_url = os.getenv("BARCODE_LIST_RU_BASE_URL", "https://barcode-list.ru").rstrip("/")
+        self.barcode_list_com_url = os.getenv("BARCODE_LIST_COM_BASE_URL", "https://barcode-list.com").rstrip("/")
+        # Страницы barcode-list читаются не дальше этого числа символов
+        self.barcode_list_max_chars = int(os.getenv("BARCODE_LIST_MAX_CHARS", str(2 * 1024 * 1024)))
+        self.barcode_list_found = TTLCache(
+            maxsize=int(os.getenv("BARCODE_LIST_CACHE_SIZE", "50000")),
+            ttl=float(os.getenv("BARCODE_LIST_FOUND_TTL", str(7 * 86400))),
+        )
+        self.barcode_list_missing = TTLCache(
+            maxsize=int(os.getenv("BARCODE_LIST_CACHE_SIZE", "50000")),
+            ttl=float(os.getenv("BARCODE_LIST_MISSING_TTL", "86400")),
+        )
+        # Общий долгоживущий HTTP-клиент создаётся при старте приложения (см. startup)
+        self.client: Optional[httpx.AsyncClient] = None
+        self.max_per_host = int(os.getenv("PARSER_MAX_CONNECTIONS_PER_HOST", "10"))
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        # Размыкатели по хостам: упавший источник пропускается на время паузы, а не ждёт таймаута
+        self.breaker_failures = int(os.getenv("PARSER_BREAKER_FAILURES", "5"))
+        self.breaker_cooldown = float(os.getenv("PARSER_BREAKER_COOLDOWN", "30"))
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Хеджирование: если ответа нет дольше квантиля задержки хоста, отправляется дубль запроса
+        self.hedge_enabled = os.getenv("PARSER_HEDGE_ENABLED", "false").lower() == "true"
+        self.hedge_quantile = float(os.getenv("PARSER_HEDGE_QUANTILE", "0.95"))
+        self.hedge_min_delay = float(os.getenv("PARSER_HEDGE_MIN_DELAY", "0.05"))
+        self.hedge_window = int(os.getenv("PARSER_HEDGE_WINDOW", "200"))
+        # Дубли тратят общий бюджет, чтобы при деградации апстрима не удваивать нагрузку на него
+        self.hedge_budget = RetryBudget(
+            ratio=float(os.getenv("PARSER_HEDGE_RATIO", "0.05")),
+            max_tokens=float(os.getenv("PARSER_HEDGE_MAX_TOKENS", "10")),
+        )
+        self._latencies: Dict[str, LatencyWindow] = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            headers={"User-Agent": "Mozilla/5.0"},
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("PARSER_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("PARSER_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=float(os.getenv("PARSER_KEEPALIVE_EXPIRY", "30")),
+            ),
+            timeout=httpx.Timeout(
+                connect=float(os.getenv("PARSER_CONNECT_TIMEOUT", "3")),
+                read=float(os.getenv("PARSER_READ_TIMEOUT", "10")),
+                write=float(os.getenv("PARSER_WRITE_TIMEOUT", "10")),
+                pool=float(os.getenv("PARSER_POOL_TIMEOUT", "5")),
+            ),
+            follow_redirects=True,
+        )
+
+    async def startup(self) -> None:
+        if self.client is None:
+            self.client = self._build_client()
+
+    async def shutdown(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        # На случай использования вне приложения (скрипты) — создаём клиент по требованию
+        if self.client is None:
+            self.client = self._build_client()
+        return self.client
+
+    def host_slot(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        return slot
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(host, self.breaker_failures, self.breaker_cooldown)
+        return breaker
+
+    @contextmanager
+    def _request(self, host: str) -> Iterator[None]:
+        """
+        Отмечает запрос к хосту как идущий. Отменённый на лету запрос остаётся отмеченным:
+        если отмена — истечение бюджета источника, размыкатель получит ошибку только за него.
+        """
+        hosts = in_flight_hosts.get()
+        if hosts is not None:
+            hosts.add(host)
+        cancelled = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            if hosts is not None and not cancelled:
+                hosts.discard(host)
+
+    def hedge_delay(self, host: str) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        window = self._latencies.get(host)
+        delay = window.quantile(self.hedge_quantile) if window is not None else None
+        return max(delay, self.hedge_min_delay) if delay is not None else None
+
+    async def _attempt(self, url: str, host: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with self.host_slot(url):
+                response = await self.http.get(url, **kwargs)
+            outcome = f"{response.status_code // 100}xx"
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            UPSTREAM_SECONDS.observe(elapsed, upstream=host, outcome=outcome)
+            if outcome != "error":
+                window = self._latencies.get(host)
+                if window is None:
+                    window = self._latencies[host] = LatencyWindow(self.hedge_window, min_samples=20)
+                window.add(elapsed)
+
+    async def _hedged(self, url: str, host: str, **kwargs) -> httpx.Response:
+        delay = self.hedge_delay(host)
+        if delay is None:
+            return await self._attempt(url, host, **kwargs)
+        self.hedge_budget.deposit()
+        tasks = [asyncio.create_task(self._attempt(url, host, **kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.hedge_budget.withdraw():
+                self.hedges += 1
+                tasks.append(asyncio.create_task(self._attempt(url, host, **kwargs)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Обе попытки упали — отдаём ошибку основной
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        """
+        GET к источнику через размыкатель хоста. Ошибкой считаются сбой соединения,
+        5xx и 429; 404 и прочие ответы — нормальный ответ «нет такого товара».
+        """
+        host = httpx.URL(url).host
+        breaker = self.breaker(host)
+        breaker.check()
+        try:
+            with self._request(host):
+                response = await self._hedged(url, host, **kwargs)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception:
+            breaker.failure()
+            raise
+        if response.status_code >= 500 or response.status_code == 429:
+            breaker.failure()
+        else:
+            breaker.success()
+        return response
     
     
+    def roskachestvo_search_url(self, barcode: str) -> str:
+        return f"{self.roskachestvo_url}/rest/1/search/barcode?barcode={barcode}"
+
     def validate_barcode(self, barcode: str):
         if not (barcode.isdigit() and len(barcode) in (8, 12, 13)):
             raise HTTPException(
@@ -28,6 +223,7 @@ class Parser:
     def extract_product_details(self, product: dict) -> dict:
         """
         Извлекаем только нужные поля из ответа OpenFoodFacts.
+        При изменении списка полей обновите services/off_mirror.OFF_FIELDS и переимпортируйте зеркало.
         """
         return {
             "product_name": product.get("product_name") or product.get("generic_name") or "No Title",
@@ -57,14 +253,17 @@ class Parser:
         }
 
     # Возвращает большой массив данных
+    @timed("openfoodfacts")
     async def fetch_from_openfoodfacts(self, barcode: str) -> Optional[dict]:
         """
-        Асинхронно обращаемся к OpenFoodFacts, фильтруем данные.
+        Сначала локальное зеркало дампа OFF, к API — только если штрихкода там нет.
         """
-        url = f"https://world.openfoodfacts.org/api/v2/product/{barcode}.json"
+        mirrored = await off_mirror.get(barcode)
+        if mirrored is not None:
+            return self.extract_product_details(mirrored)
+        url = f"{self.openfoodfacts_url}/api/v2/product/{barcode}.json"
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url)
+            response = await self.get(url)
             if response.status_code == 200:
                 data = response.json()
                 if data.get("status") == 1:
@@ -75,11 +274,14 @@ class Parser:
         return None
 
 
+    @timed("roskachestvo")
     async def fetch_from_roskachestvo(self, barcode: str) -> Optional[dict]:
-        url = f"https://rskrf.ru/rest/1/search/barcode?barcode={barcode}"
+        url = self.roskachestvo_search_url(barcode)
         
         try:
-            response = requests.get(url)
+            response = await self.get(url)
+            if response.status_code == 404:
+                return None
             response.raise_for_status()
             
             data = response.json()
@@ -105,39 +307,159 @@ class Parser:
             
             return result
             
-        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+        except (httpx.HTTPError, json.JSONDecodeError, CircuitOpenError) as e:
             print(f"Error: {e}")
             return None
         
+    def barcode_list_urls(self, barcode: str) -> List[str]:
+        return [
+            f"{self.barcode_list_ru_url}/barcode/RU/%D0%9F%D0%BE%D0%B8%D1%81%D0%BA.htm?barcode={barcode}",
+            f"{self.barcode_list_com_url}/barcode/EN/barcode-{barcode}/Search.htm",
+        ]
+
+    async def _barcode_list_page(self, url: str) -> Optional[bool]:
+        """
+        Читает страницу потоком и разбирает её по мере прихода кусков; соединение
+        закрывается, как только известна первая строка таблицы результатов.
+        None — сайт не ответил, ответ неизвестен.
+        """
+        extractor = BarcodeTableExtractor()
+        received = 0
+        host = httpx.URL(url).host
+        breaker = self.breaker(host)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            breaker.check()
+            with self._request(host):
+                async with self.host_slot(url):
+                    async with self.http.stream("GET", url, timeout=self.deadlines["barcode_list"]) as response:
+                        outcome = f"{response.status_code // 100}xx"
+                        if response.status_code >= 500 or response.status_code == 429:
+                            breaker.failure()
+                            return None
+                        breaker.success()
+                        if response.status_code == 404:
+                            return False
+                        if response.status_code != 200:
+                            return None
+                        async for chunk in response.aiter_text():
+                            extractor.feed(chunk)
+                            received += len(chunk)
+                            if extractor.done or received >= self.barcode_list_max_chars:
+                                break
+            extractor.close()
+            return extractor.found
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except CircuitOpenError as e:
+            print(f"Пропуск {url}: {e}")
+            return None
+        except Exception as e:
+            breaker.failure()
+            print(f"Ошибка при запросе {url}: {e}")
+            return None
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream=host, outcome=outcome)
+
+    @timed("barcode_list")
     async def product_exists_in_barcode_lists(self, barcode: str) -> bool:
         """
         Проверяет наличие продукта по штрихкоду на barcode-list.ru и barcode-list.com.
-        Возвращает True, если продукт найден хотя бы на одном из сайтов, иначе False.
+        Оба сайта опрашиваются одновременно; первый положительный ответ отменяет второй.
+        Ответы хранятся в TTL-кэше: найденные — дольше, не найденные — меньше.
         """
-        urls = [
-            f"https://barcode-list.ru/barcode/RU/%D0%9F%D0%BE%D0%B8%D1%81%D0%BA.htm?barcode={barcode}",
-            f"https://barcode-list.com/barcode/EN/barcode-{barcode}/Search.htm"
-        ]
-        for url in urls:
-            async with httpx.AsyncClient() as client:
-                try:
-                    response = await client.get(url, timeout=10)
-                    if response.status_code == 200:
-                        html_text = response.text
-                        soup = BeautifulSoup(html_text, "html.parser")
-                        table = soup.find("table", class_="randomBarcodes")
-                        if not table:
-                            table = soup.find("table")
-                        if table:
-                            rows = table.find_all("tr")
-                            if len(rows) > 1:
-                                tds = rows[1].find_all("td")
-                                if len(tds) >= 3:
-                                    product_name = tds[2].get_text(strip=True)
-                                    if product_name:
-                                        return True
-                except Exception as e:
-                    print(f"Ошибка при запросе {url}: {e}")
+        if self.barcode_list_found.get(barcode):
+            return True
+        if self.barcode_list_missing.get(barcode):
+            return False
+        tasks = [asyncio.create_task(self._barcode_list_page(url)) for url in self.barcode_list_urls(barcode)]
+        answers = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                answer = await next_done
+                if answer:
+                    self.barcode_list_found.set(barcode, True)
+                    return True
+                answers.append(answer)
+        finally:
+            for task in tasks:
+                task.cancel()
+        # «Не найдено» запоминаем, только если ответили оба сайта
+        if all(answer is False for answer in answers):
+            self.barcode_list_missing.set(barcode, True)
         return False
 
+    def is_usable(self, source: str, data: Any) -> bool:
+        if source == "roskachestvo":
+            return bool(data and data.get("product", {}).get("title"))
+        if source == "openfoodfacts":
+            return bool(data and data.get("product_name") and data.get("ingredients_text"))
+        return bool(data)
+
+    async def _with_deadline(self, source: str, coro: Awaitable[Any]) -> Any:
+        hosts: Set[str] = set()
+        token = in_flight_hosts.set(hosts)
+        try:
+            data = await asyncio.wait_for(coro, timeout=self.deadlines[source])
+        except asyncio.TimeoutError:
+            print(f"Источник {source} не ответил за {self.deadlines[source]} с")
+            SOURCE_RESULTS.inc(source=source, result="timeout")
+            # Выход за бюджет задержки — такая же ошибка для размыкателя, как сбой соединения,
+            # но только для хостов, чей запрос ещё шёл: успевший ответить сайт не виноват
+            for host in hosts:
+                self.breaker(host).failure()
+            return None
+        finally:
+            in_flight_hosts.reset(token)
+        SOURCE_RESULTS.inc(source=source, result="hit" if self.is_usable(source, data) else "miss")
+        return data
+
+    @timed("lookup")
+    async def find_source(self, barcode: str) -> Optional[Tuple[str, Any]]:
+        """
+        Ищет продукт по источникам в порядке приоритета: Роскачество > OpenFoodFacts > barcode-list.
+        Возвращает (источник, данные) первого пригодного результата или None.
+        В режиме parallel все источники запускаются сразу, а лишние отменяются,
+        как только известен ответ приоритетного источника.
+        """
+        sources = [
+            ("roskachestvo", self.fetch_from_roskachestvo),
+            ("openfoodfacts", self.fetch_from_openfoodfacts),
+            ("barcode_list", self.product_exists_in_barcode_lists),
+        ]
+        if self.lookup_mode == "sequential":
+            for source, fetch in sources:
+                data = await self._with_deadline(source, fetch(barcode))
+                if self.is_usable(source, data):
+                    return source, data
+            return None
+
+        tasks = [
+            (source, asyncio.create_task(self._with_deadline(source, fetch(barcode))))
+            for source, fetch in sources
+        ]
+        try:
+            for source, task in tasks:
+                data = await task
+                if self.is_usable(source, data):
+                    return source, data
+            return None
+        finally:
+            for _, task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "breakers": {host: breaker.stats() for host, breaker in self._breakers.items()},
+            "hedge": {
+                "enabled": self.hedge_enabled,
+                "sent": self.hedges,
+                "won": self.hedge_wins,
+                **self.hedge_budget.stats(),
+            },
+        }
+
 parser = Parser()
\ No newline at end of file
@@ -0,0 +1,92 @@
+from typing import Any, Optional
+from models import Product, ProductStatus
+from services.analyzer import analyzer
+from services.images import image_fetcher
+
+
+# Сборка Product из ответа источника и результата LLM-анализа
+
+
+def from_roskachestvo(barcode: str, roskachestvo_data: dict, analysis: dict, local_image_url: Optional[str] = None) -> Product:
+    return Product(
+        barcode=barcode,
+        product_name=analysis.get("product_name", roskachestvo_data["product"].get("title", "No Product Name")),
+        manufacturer=analysis.get("manufacturer", roskachestvo_data["product"].get("manufacturer")),
+        score=analysis.get("overall_score", roskachestvo_data["product"].get("total_rating")),
+        nutrition=analysis.get("nutrition"),
+        allergens=analysis.get("allergens"),
+        image_front=local_image_url or roskachestvo_data["product"].get("thumbnail"),
+        image_ingredients=None,
+        tags=analysis.get("tags"),
+        status=ProductStatus.verified,
+        extra={
+            "description": roskachestvo_data["product"].get("description"),
+            "category_name": roskachestvo_data["product"].get("category_name"),
+            "ingredients": analysis.get("ingredients"),
+            "explanation_score": analysis.get("explanation_score"),
+            "harmful_components": analysis.get("harmful_components"),
+            "recommendedfor": analysis.get("recommendedfor"),
+            "frequency": analysis.get("frequency"),
+            "alternatives": analysis.get("alternatives"),
+            "roskachestvo_recommendations": roskachestvo_data.get("recommendations", [])
+        }
+    )
+
+
+def from_openfoodfacts(barcode: str, details: dict, analysis: dict) -> Product:
+    return Product(
+        barcode=barcode,
+        product_name=analysis.get("product_name", "No Product Name"),
+        manufacturer=analysis.get("manufacturer"),
+        score=analysis.get("overall_score"),
+        nutrition=analysis.get("nutrition"),
+        allergens=analysis.get("allergens"),
+        image_front=details.get("image_front_url"),
+        image_ingredients=details.get("image_ingredients_url"),
+        tags=analysis.get("tags"),
+        status=ProductStatus.verified,
+        extra={
+            "ingredients": analysis.get("ingredients"),
+            "explanation_score": analysis.get("explanation_score"),
+            "harmful_components": analysis.get("harmful_components"),
+            "recommendedfor": analysis.get("recommendedfor"),
+            "frequency": analysis.get("frequency"),
+            "alternatives": analysis.get("alternatives"),
+        }
+    )
+
+
+def empty(barcode: str) -> Product:
+    # Найден только в barcode-list: сохраняем штрихкод с пустыми данными
+    return Product(
+        barcode=barcode,
+        product_name="",
+        manufacturer=None,
+        score=None,
+        nutrition=None,
+        allergens=None,
+        image_front=None,
+        image_ingredients=None,
+        tags=None,
+        status=None,
+        extra=None
+    )
+
+
+async def build(barcode: str, source: str, data: Any) -> Product:
+    """
+    Полный путь от ответа источника до Product: картинка, LLM-анализ, сборка.
+    Общий для /find и фонового обновления.
+    """
+    if source == "roskachestvo":
+        image_url = data["product"].get("thumbnail")
+        local_image_url = None
+        if image_url:
+            local_image_url = await image_fetcher.fetch(image_url, barcode, "roskachestvo")
+        analysis = await analyzer.analyze_data(data["product"])
+        return from_roskachestvo(barcode, data, analysis, local_image_url)
+    if source == "openfoodfacts":
+        analysis = await analyzer.analyze_data(data)
+        return from_openfoodfacts(barcode, data, analysis)
+    # Если найден только в barcode-list, сохраняем только barcode и возвращаем null-данные
+    return empty(barcode)
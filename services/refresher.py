@@ -0,0 +1,153 @@
+import os
+import asyncio
+from typing import Dict, List, Set
+from database import db, EMPTY_PRODUCT_NAMES, WEB_CONCURRENCY
+from models import Product, ProductStatus
+from services.cache import TTLCache
+from services.limits import TokenBucket
+from services.parser import parser
+from services import products
+
+# Приоритет товаров, которые пользователи сканируют прямо сейчас, выше любого из выборки
+SCAN_PRIORITY = 100.0
+
+
+class Refresher:
+    """
+    Фоновое обновление сохранённых товаров (stale-while-revalidate): /find отдаёт
+    копию из БД, а пустые, ожидающие модерации и устаревшие товары перепроверяются
+    в источниках и заново анализируются в очереди с приоритетом. Популярные
+    товары идут первыми; число обновлений ограничено бюджетом в час.
+    """
+    def __init__(self):
+        self.enabled = os.getenv("REFRESH_ENABLED", "true").lower() == "true"
+        self.workers = int(os.getenv("REFRESH_WORKERS", "2"))
+        self.interval = float(os.getenv("REFRESH_INTERVAL", "300"))
+        self.batch_size = int(os.getenv("REFRESH_BATCH_SIZE", "100"))
+        self.max_age = float(os.getenv("REFRESH_MAX_AGE_DAYS", "30")) * 86400
+        # Неудачную или бесполезную попытку повторяем не раньше, чем через retry_after
+        self.retry_after = float(os.getenv("REFRESH_RETRY_AFTER", "21600"))
+        self.scan_flush_interval = float(os.getenv("REFRESH_SCAN_FLUSH_INTERVAL", "30"))
+        # Бюджет общий на все воркеры, как и соединения с БД
+        budget = float(os.getenv("REFRESH_BUDGET_PER_HOUR", "120")) / WEB_CONCURRENCY
+        self.budget = TokenBucket(rate=budget / 3600, burst=max(1.0, budget / 60)) if budget > 0 else None
+        self.queue_size = int(os.getenv("REFRESH_QUEUE_SIZE", "1000"))
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        self._queued: Set[str] = set()
+        self._attempted = TTLCache(maxsize=self.queue_size * 10, ttl=self.retry_after)
+        self._scans: Dict[str, int] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.refreshed = 0
+        self.unchanged = 0
+        self.failed = 0
+
+    def needs_refresh(self, product: Product) -> bool:
+        status = product.status.value if isinstance(product.status, ProductStatus) else product.status
+        return not product.product_name or product.product_name in EMPTY_PRODUCT_NAMES or status == "pending"
+
+    def record_scan(self, product: Product) -> None:
+        if not self._tasks:
+            return
+        self._scans[product.barcode] = self._scans.get(product.barcode, 0) + 1
+        if self.needs_refresh(product):
+            self.enqueue(product.barcode, SCAN_PRIORITY)
+
+    def enqueue(self, barcode: str, priority: float) -> None:
+        if barcode in self._queued or self._attempted.get(barcode):
+            return
+        try:
+            self._queue.put_nowait((-priority, barcode))
+        except asyncio.QueueFull:
+            return
+        self._queued.add(barcode)
+
+    async def startup(self) -> None:
+        if not self.enabled or self.budget is None or self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._schedule()),
+            asyncio.create_task(self._flush_scans_loop()),
+            *(asyncio.create_task(self._worker()) for _ in range(self.workers)),
+        ]
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._flush_scans()
+
+    async def _flush_scans(self) -> None:
+        counts, self._scans = self._scans, {}
+        try:
+            await db.record_scans(counts)
+        except Exception as e:
+            print(f"Ошибка записи счётчиков сканирований: {e}")
+
+    async def _flush_scans_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.scan_flush_interval)
+            await self._flush_scans()
+
+    async def _schedule(self) -> None:
+        while True:
+            try:
+                # Не набираем больше, чем успеем обработать до следующего прохода
+                free = self.queue_size - self._queue.qsize()
+                if free > 0:
+                    candidates = await db.refresh_candidates(
+                        min(self.batch_size, free), self.max_age, self.retry_after
+                    )
+                    for barcode, priority in candidates:
+                        self.enqueue(barcode, priority)
+            except Exception as e:
+                print(f"Ошибка выборки товаров для обновления: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _worker(self) -> None:
+        while True:
+            _, barcode = await self._queue.get()
+            self._queued.discard(barcode)
+            await self.budget.acquire()
+            try:
+                if not await db.claim_refresh(barcode, self.retry_after):
+                    continue
+                self._attempted.set(barcode, True)
+                await self.refresh(barcode)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"Ошибка фонового обновления {barcode}: {e}")
+
+    async def refresh(self, barcode: str) -> None:
+        found = await parser.find_source(barcode)
+        if found is None or found[0] == "barcode_list":
+            # Источники не дали ничего лучше — оставляем сохранённую копию
+            await db.mark_fetched(barcode)
+            self.unchanged += 1
+            return
+        source, data = found
+        product = await products.build(barcode, source, data)
+        if not product.product_name or product.product_name in EMPTY_PRODUCT_NAMES:
+            # Анализ не удался — не затираем сохранённую копию пустой
+            await db.mark_fetched(barcode)
+            self.unchanged += 1
+            return
+        # Пока шло обновление, товар могли поправить в панели — правку не затираем
+        await db.upsert_many([product], keep_edited=True)
+        self.refreshed += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": bool(self._tasks),
+            "queued": self._queue.qsize(),
+            "pending_scans": len(self._scans),
+            "refreshed": self.refreshed,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "budget_tokens": round(self.budget.tokens, 2) if self.budget is not None else 0.0,
+        }
+
+
+refresher = Refresher()
@@ -0,0 +1,30 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные вызовы с одинаковым ключом в одну задачу.
+    Первый вызов выполняет работу, остальные ждут тот же результат (или ту же ошибку).
+    """
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Забираем исключение, чтобы asyncio не ругался, если все ожидающие отвалились
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield: отключившийся клиент не отменяет работу для остальных ожидающих
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
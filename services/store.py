@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class CacheStore:
+    """
+    Общий для всех воркеров уровень кэша. Реализации должны уметь
+    хранить байты с TTL и рассылать инвалидации остальным процессам.
+    """
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, key: str) -> None:
+        """Удаляет ключ и сообщает о нём остальным воркерам."""
+        self.delete(key)
+
+    def version(self) -> int:
+        """Позиция журнала инвалидаций; берётся до чтения данных, которые потом кладутся в кэш."""
+        return 0
+
+    def set_if_unchanged(self, key: str, value: bytes, ttl: float, version: int) -> bool:
+        """Записывает значение, только если ключ не инвалидировали после version."""
+        self.set(key, value, ttl)
+        return True
+
+    def poll_invalidations(self) -> List[str]:
+        """Ключи, инвалидированные другими воркерами с прошлого вызова."""
+        return []
+
+    def cleanup(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStore(CacheStore):
+    # Для одного процесса и тестов: инвалидации рассылать некому
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.time():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._data[key] = (time.time() + ttl, value)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def cleanup(self) -> None:
+        now = time.time()
+        for key in [k for k, (expires_at, _) in self._data.items() if expires_at <= now]:
+            self._data.pop(key, None)
+
+
+class SQLiteStore(CacheStore):
+    """
+    Общий кэш в SQLite-файле (WAL): читают и пишут все воркеры на машине.
+    Инвалидации пишутся в журнал, каждый воркер дочитывает его со своего id.
+    """
+    def __init__(self, path: str, invalidation_retention: float = 3600):
+        self.path = path
+        self.invalidation_retention = invalidation_retention
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS invalidations ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS invalidations_key ON invalidations (key, id)")
+        row = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM invalidations").fetchone()
+        self._last_invalidation_id = row[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            cursor = self._conn.execute(
+                "INSERT INTO invalidations (key, created_at) VALUES (?, ?)", (key, time.time())
+            )
+            self._conn.execute("COMMIT")
+            # Свою инвалидацию воркер уже применил локально
+            if cursor.lastrowid == self._last_invalidation_id + 1:
+                self._last_invalidation_id = cursor.lastrowid
+
+    def version(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM invalidations").fetchone()[0]
+
+    def set_if_unchanged(self, key: str, value: bytes, ttl: float, version: int) -> bool:
+        # Проверка и запись в одной транзакции: инвалидация (удаление + запись в журнал) тоже
+        # атомарна, поэтому она либо видна здесь, либо удалит записанное значение после нас
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                stale = self._conn.execute(
+                    "SELECT 1 FROM invalidations WHERE key = ? AND id > ? LIMIT 1", (key, version)
+                ).fetchone()
+                if stale is None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, time.time() + ttl),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return stale is None
+
+    def poll_invalidations(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, key FROM invalidations WHERE id > ? ORDER BY id", (self._last_invalidation_id,)
+            ).fetchall()
+        if rows:
+            self._last_invalidation_id = rows[-1][0]
+        return [key for _, key in rows]
+
+    def cleanup(self) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM invalidations WHERE created_at < ?", (now - self.invalidation_retention,)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def build_store() -> CacheStore:
+    kind = os.getenv("CACHE_STORE", "sqlite").lower()
+    if kind == "memory":
+        return MemoryStore()
+    return SQLiteStore(os.getenv("CACHE_STORE_PATH", "cache/shared.sqlite3"))
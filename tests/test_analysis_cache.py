@@ -0,0 +1,50 @@
+import asyncio
+import sqlite3
+from services.analysis_cache import AnalysisCache
+
+
+def make_cache(tmp_path, monkeypatch, max_bytes: int) -> AnalysisCache:
+    monkeypatch.setenv("ANALYSIS_CACHE_PATH", str(tmp_path / "analysis.sqlite3"))
+    monkeypatch.setenv("ANALYSIS_CACHE_MAX_BYTES", str(max_bytes))
+    return AnalysisCache()
+
+
+def stored(cache: AnalysisCache):
+    conn = sqlite3.connect(cache.path)
+    try:
+        count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis").fetchone()
+        total = conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+    finally:
+        conn.close()
+    return count, size, total
+
+
+def test_eviction_stops_at_target(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch, max_bytes=5000)
+
+    async def fill():
+        for i in range(100):
+            await cache.set(f"key-{i}", {"analysis": "x" * 80, "n": i})
+
+    asyncio.run(fill())
+    count, size, total = stored(cache)
+    cache.close()
+    assert total == size
+    assert size <= 5000
+    # Вытесняется только лишнее: кэш остаётся заполнен хотя бы до 90% лимита без одной записи
+    assert size > 5000 * 0.9 - 100
+    assert cache.evictions == 100 - count
+
+
+def test_recently_read_key_survives(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch, max_bytes=5000)
+
+    async def scenario():
+        await cache.set("hot", {"analysis": "hot"})
+        for i in range(100):
+            await cache.get("hot")
+            await cache.set(f"key-{i}", {"analysis": "x" * 80, "n": i})
+        return await cache.get("hot")
+
+    assert asyncio.run(scenario()) == {"analysis": "hot"}
+    cache.close()
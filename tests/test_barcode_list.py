@@ -0,0 +1,57 @@
+import os
+import pytest
+from services.barcode_list import BarcodeTableExtractor, product_name_present
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures")
+
+
+def fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("barcode_list_found.html", True),
+    ("barcode_list_missing.html", False),
+])
+def test_fixture_pages(name, expected):
+    assert product_name_present(fixture(name)) is expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 512])
+def test_chunked_feed_stops_early(chunk_size):
+    html = fixture("barcode_list_found.html")
+    extractor = BarcodeTableExtractor()
+    consumed = 0
+    while not extractor.done and consumed < len(html):
+        extractor.feed(html[consumed:consumed + chunk_size])
+        consumed += chunk_size
+    assert extractor.done
+    assert extractor.found
+    assert consumed < len(html)
+
+
+def test_results_table_preferred_over_first_table():
+    html = (
+        "<table><tr><td>h</td></tr><tr><td>1</td><td>2</td><td>Layout</td></tr></table>"
+        "<table class='randomBarcodes'><tr><th>a</th><th>b</th><th>c</th></tr>"
+        "<tr><td>4600000000000</td><td>x</td><td> </td></tr></table>"
+    )
+    assert product_name_present(html) is False
+
+
+def test_falls_back_to_first_table():
+    html = (
+        "<table><tr><th>a</th><th>b</th><th>c</th></tr>"
+        "<tr><td>4600000000000</td><td>x</td><td>Молоко</td></tr></table>"
+    )
+    assert product_name_present(html) is True
+
+
+def test_truncated_page():
+    html = (
+        "<table class='randomBarcodes'><tr><th>a</th><th>b</th><th>c</th></tr>"
+        "<tr><td>4600000000000</td><td>x</td><td>Кефир"
+    )
+    assert product_name_present(html) is True
+    assert product_name_present("<html><body>нет таблиц") is False
@@ -0,0 +1,77 @@
+import pytest
+from services import limits
+from services.limits import CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(limits.time, "monotonic", clock)
+    return clock
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker("host", failure_threshold=3, cooldown=10)
+    for _ in range(2):
+        breaker.check()
+        breaker.failure()
+    assert breaker.state == "closed"
+    breaker.check()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert breaker.trips == 1
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    assert breaker.rejected == 1
+
+
+def test_success_resets_failures(clock):
+    breaker = CircuitBreaker("host", failure_threshold=2, cooldown=10)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("host", failure_threshold=1, cooldown=10)
+    breaker.failure()
+    clock.now += 10
+    breaker.check()
+    assert breaker.state == "half_open"
+    # Пока пробный запрос не вернулся, остальные отклоняются
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.success()
+    assert breaker.state == "closed"
+    breaker.check()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("host", failure_threshold=1, cooldown=10)
+    breaker.failure()
+    clock.now += 10
+    breaker.check()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_released_probe_frees_the_slot(clock):
+    breaker = CircuitBreaker("host", failure_threshold=1, cooldown=10)
+    breaker.failure()
+    clock.now += 10
+    breaker.check()
+    breaker.release()
+    assert breaker.state == "half_open"
+    breaker.check()
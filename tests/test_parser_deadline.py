@@ -0,0 +1,61 @@
+import asyncio
+import httpx
+from services.parser import Parser
+
+MISSING_PAGE = "<table class='randomBarcodes'><tr><th>a</th><th>b</th><th>c</th></tr></table>"
+
+
+def make_parser(handler) -> Parser:
+    parser = Parser()
+    parser.barcode_list_ru_url = "http://ru.test"
+    parser.barcode_list_com_url = "http://com.test"
+    parser.roskachestvo_url = "http://rs.test"
+    parser.deadlines = {"roskachestvo": 0.2, "openfoodfacts": 0.2, "barcode_list": 0.2}
+    parser.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return parser
+
+
+def run(parser: Parser, coro):
+    async def scenario():
+        try:
+            return await coro
+        finally:
+            await parser.shutdown()
+    return asyncio.run(scenario())
+
+
+def test_deadline_blames_only_hosts_still_running():
+    async def handler(request):
+        if request.url.host == "com.test":
+            await asyncio.sleep(5)
+        return httpx.Response(200, text=MISSING_PAGE)
+
+    parser = make_parser(handler)
+    result = run(parser, parser._with_deadline("barcode_list", parser.product_exists_in_barcode_lists("4600000000000")))
+    assert result is None
+    assert parser.breaker("ru.test").failures == 0
+    assert parser.breaker("com.test").failures == 1
+
+
+def test_deadline_skips_host_that_never_started():
+    async def handler(request):
+        await asyncio.sleep(5)
+        return httpx.Response(200, text=MISSING_PAGE)
+
+    parser = make_parser(handler)
+    ru = parser.breaker("ru.test")
+    ru.state = "open"
+    ru.opened_at = float("inf")
+    run(parser, parser._with_deadline("barcode_list", parser.product_exists_in_barcode_lists("4600000000000")))
+    assert ru.failures == 0
+    assert parser.breaker("com.test").failures == 1
+
+
+def test_deadline_counts_slow_get():
+    async def handler(request):
+        await asyncio.sleep(5)
+        return httpx.Response(404)
+
+    parser = make_parser(handler)
+    assert run(parser, parser._with_deadline("roskachestvo", parser.fetch_from_roskachestvo("4600000000000"))) is None
+    assert parser.breaker("rs.test").failures == 1
@@ -0,0 +1,108 @@
+import asyncio
+import httpx
+import pytest
+from services.limits import LatencyWindow
+from services.parser import Parser
+
+URL = "http://upstream.test/item"
+
+
+def make_parser(handler) -> Parser:
+    parser = Parser()
+    parser.hedge_enabled = True
+    parser.hedge_min_delay = 0.05
+    parser.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return parser
+
+
+def prime(parser: Parser) -> None:
+    # Задержка хоста известна: квантиль считается по 20 быстрым ответам
+    window = parser._latencies["upstream.test"] = LatencyWindow(parser.hedge_window, min_samples=20)
+    for _ in range(20):
+        window.add(0.01)
+
+
+def test_hedge_wins_and_cancels_primary():
+    calls = []
+    cancelled = []
+
+    async def handler(request):
+        attempt = len(calls)
+        calls.append(attempt)
+        if attempt == 0:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(attempt)
+                raise
+        return httpx.Response(200, text=f"attempt {attempt}")
+
+    async def scenario():
+        parser = make_parser(handler)
+        prime(parser)
+        response = await asyncio.wait_for(parser.get(URL), timeout=2)
+        await asyncio.sleep(0)
+        await parser.shutdown()
+        return parser, response
+
+    parser, response = asyncio.run(scenario())
+    assert response.text == "attempt 1"
+    assert calls == [0, 1]
+    assert cancelled == [0]
+    assert parser.hedges == 1
+    assert parser.hedge_wins == 1
+    assert parser.breaker("upstream.test").state == "closed"
+
+
+def test_fast_primary_sends_no_hedge():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return httpx.Response(200)
+
+    async def scenario():
+        parser = make_parser(handler)
+        prime(parser)
+        await parser.get(URL)
+        await parser.shutdown()
+        return parser
+
+    parser = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert parser.hedges == 0
+
+
+def test_no_hedge_without_latency_history():
+    async def handler(request):
+        await asyncio.sleep(0.1)
+        return httpx.Response(200)
+
+    async def scenario():
+        parser = make_parser(handler)
+        await parser.get(URL)
+        await parser.shutdown()
+        return parser
+
+    assert asyncio.run(scenario()).hedges == 0
+
+
+def test_both_attempts_fail_raises_primary_error():
+    async def handler(request):
+        await asyncio.sleep(0.1)
+        raise httpx.ConnectError("down", request=request)
+
+    async def scenario():
+        parser = make_parser(handler)
+        prime(parser)
+        try:
+            with pytest.raises(httpx.ConnectError):
+                await parser.get(URL)
+            return parser
+        finally:
+            await parser.shutdown()
+
+    parser = asyncio.run(scenario())
+    assert parser.hedges == 1
+    assert parser.hedge_wins == 0
+    assert parser.breaker("upstream.test").failures == 1